@@ -1,43 +1,160 @@
 import re
+import json
 import os.path
 import datetime
-import functools
 import collections
 
+import numpy
+
 from ipaddr import IPNetwork, IPAddress
 from hw_info import get_hw_info, ssize2b
-from multiprocessing import Pool as MPExecutorPool
+from storage import iter_lines, parse_timer
+from profiling import stage
+import perf_store
+import multiprocessing
+
+
+class Record(object):
+    # compact model object: declared fields are stored in __slots__,
+    # all other keys (mostly raw ceph json fields) go to extras dict,
+    # both are accessible as attributes. Fields from lazy_fields are
+    # filled on first access by loader(record, field_name)
+    __slots__ = ('extras', 'loader')
+    _fields_cache = {}
+    lazy_fields = ()
+
+    def __init__(self, **attrs):
+        self.extras = {}
+        self.loader = None
+        self.update(attrs)
+
+    @classmethod
+    def fields(cls):
+        try:
+            return cls._fields_cache[cls]
+        except KeyError:
+            fields = []
+            for tp in reversed(cls.__mro__):
+                fields.extend(name for name in tp.__dict__.get('__slots__', ())
+                              if name not in ('extras', 'loader'))
+            cls._fields_cache[cls] = fields
+            return fields
+
+    def update(self, attrs):
+        for name, val in attrs.items():
+            setattr(self, name, val)
+
+    def __setattr__(self, name, val):
+        try:
+            object.__setattr__(self, name, val)
+        except AttributeError:
+            self.extras[name] = val
+
+    def __getattr__(self, name):
+        # called only for unset slots and unknown names
+        try:
+            return object.__getattribute__(self, 'extras')[name]
+        except (KeyError, AttributeError):
+            pass
+
+        if name in self.lazy_fields:
+            loader = object.__getattribute__(self, 'loader')
+            if loader is not None:
+                loader(self, name)
+                try:
+                    return object.__getattribute__(self, name)
+                except AttributeError:
+                    pass
+
+        raise AttributeError(name)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def __contains__(self, name):
+        if name in self.extras:
+            return True
+        return name in self.fields() and hasattr(self, name)
+
+    def items(self):
+        # set fields only, lazy fields are not loaded
+        res = []
+        for name in self.fields():
+            try:
+                res.append((name, object.__getattribute__(self, name)))
+            except AttributeError:
+                pass
+        res.extend(self.extras.items())
+        return res
+
+    def __getstate__(self):
+        return dict(self.items())
+
+    def __setstate__(self, state):
+        self.extras = {}
+        self.loader = None
+        self.update(state)
+
 
+class CephOSD(Record):
+    __slots__ = ('id', 'name', 'status', 'host', 'daemon_runs', 'pg_count', 'config', 'pgs',
+                 'data_stor_stats', 'j_stor_stats', 'osd_perf', 'crush_weight', 'reweight')
+    lazy_fields = ('config',)
 
-class CephOSD(object):
     def __init__(self):
+        Record.__init__(self)
         self.id = None
         self.status = None
         self.host = None
         self.daemon_runs = None
         self.pg_count = None
-        self.config = None
         self.pgs = {}
         self.data_stor_stats = None
         self.j_stor_stats = None
 
 
-class CephMonitor(object):
+class CephMonitor(Record):
+    __slots__ = ('name', 'status', 'host', 'role', 'health', 'kb_avail', 'avail_percent')
+
     def __init__(self):
+        Record.__init__(self)
         self.name = None
         self.status = None
         self.host = None
         self.role = None
 
 
-class Pool(object):
+class Pool(Record):
+    __slots__ = ('id', 'name', 'size', 'min_size', 'crush_ruleset', 'pg_num', 'pg_placement_num',
+                 'num_objects', 'size_bytes', 'read_bytes', 'write_bytes')
+
     def __init__(self):
+        Record.__init__(self)
         self.id = None
         self.name = None
 
 
-class NetworkAdapter(object):
+class DevStats(Record):
+    # osd data/journal device info, *_curr and *_uptime fields are filled on
+    # first access and only if device load is known, use 'field in stats' to check
+    __slots__ = ('dev', 'root_dev', 'used', 'avail', 'is_ssd',
+                 'read_bytes_curr', 'write_bytes_curr', 'read_iops_curr', 'write_iops_curr',
+                 'io_time_curr', 'w_io_time_curr', 'iops_curr', 'queue_depth_curr', 'lat_curr',
+                 'read_bytes_uptime', 'write_bytes_uptime', 'read_iops_uptime', 'write_iops_uptime',
+                 'io_time_uptime', 'w_io_time_uptime')
+    lazy_fields = __slots__[5:]
+
+
+class NetLoad(Record):
+    __slots__ = ('sbytes', 'rbytes', 'spackets', 'rpackets')
+
+
+class NetworkAdapter(Record):
+    __slots__ = ('name', 'ip', 'is_phy', 'speed', 'duplex', 'perf_stats', 'perf_delta', 'perf_stats_curr')
+    lazy_fields = ('perf_stats_curr',)
+
     def __init__(self, name, ip):
+        Record.__init__(self)
         self.name = name
         self.ip = ip
         self.is_phy = None
@@ -45,47 +162,56 @@ class NetworkAdapter(object):
         self.duplex = None
         self.perf_stats = None
         self.perf_delta = None
-        self.perf_stats_curr = None
 
 
-class Disk(object):
+class Disk(Record):
+    __slots__ = ('dev', 'perf_stats', 'perf_delta')
+
     def __init__(self, dev):
+        Record.__init__(self)
         self.dev = dev
         self.perf_stats = None
         self.perf_delta = None
 
 
-class Host(object):
+class Host(Record):
+    __slots__ = ('name', 'cluster_net', 'public_net', 'net_adapters', 'disks', 'uptime',
+                 'perf_monitoring', 'rusage_stats', 'hw_cache_info', 'hw_info',
+                 'mem_total', 'mem_free', 'swap_total', 'swap_free', 'load_5m')
+    lazy_fields = ('hw_info', 'rusage_stats', 'perf_monitoring')
+
     def __init__(self, name):
+        Record.__init__(self)
         self.name = name
         self.cluster_net = None
         self.public_net = None
         self.net_adapters = {}
         self.disks = {}
         self.uptime = None
-        self.perf_monitoring = None
-        self.rusage_stats = None
+        self.hw_cache_info = None
 
 
-class TabulaRasa(object):
-    def __init__(self, **attrs):
-        self.__dict__.update(attrs)
+class DevLoadLog(object):
+    def __init__(self, name, start_timstamp, fields, data):
+        self.name = name
+        self.start_timstamp = start_timstamp
+        self.fields = list(fields)
+        self.field_idx = dict((field, idx) for idx, field in enumerate(self.fields))
+        # float64 array [samples, fields], one sample per second
+        self.data = data
 
-    def get(self, name, default=None):
-        try:
-            return self.__dict__.get(name, default)
-        except KeyError:
-            raise AttributeError(name)
+    def __len__(self):
+        return self.data.shape[0]
 
-    def __contains__(self, name):
-        return name in self.__dict__
+    def __getitem__(self, field):
+        return self.data[:, self.field_idx[field]]
 
+    def sample(self, idx):
+        return dict(zip(self.fields, self.data[idx].tolist()))
 
-class DevLoadLog(object):
-    def __init__(self, name, start_timstamp):
-        self.name = name
-        self.values = []
-        self.start_timstamp = start_timstamp
+    def total_delta(self):
+        # field => last sample - first sample
+        return dict(zip(self.fields, (self.data[-1] - self.data[0]).tolist()))
 
 
 diskstat_fields = [
@@ -104,7 +230,8 @@ diskstat_fields = [
     "io_time",
     "weighted_io_time"]
 
-DiskStats = collections.namedtuple("DiskStats", diskstat_fields)
+# fields of parsed /proc/diskstats rows, device name is the key
+rusage_disk_fields = [field for field in diskstat_fields if field != 'device']
 
 
 netstat_fields = ("rbytes rpackets rerrs rdrop rfifo rframe rcompressed" +
@@ -114,113 +241,311 @@ netstat_fields = ("rbytes rpackets rerrs rdrop rfifo rframe rcompressed" +
 NetStats = collections.namedtuple("NetStats", netstat_fields)
 
 
-def parse_netdev(netdev):
-    info = {}
+def cputime_to_seconds(val):
+    if '-' in val:
+        days, rest = val.split('-')
+    else:
+        days, rest = 0, val
+
+    h, m, s = map(int, rest.split(":"))
+    return int(days) * 24 * 3600 + h * 3600 + m * 60 + s
+
+
+# name, fields, leading columns to skip, field types
+perf_log_formats = [('io', diskstat_fields[3:], 2, None),
+                    ('net', netstat_fields, 0, None),
+                    ('cpu', ['cpu'], 0, [cputime_to_seconds])]
+
+
+def stats_to_arrays(rows):
+    # dev => list of str fields to dev => int64 array, one numpy call per snapshot
+    if not rows:
+        return {}
+    devs = list(rows)
+    arr = numpy.array([rows[dev] for dev in devs], dtype=numpy.int64)
+    return dict(zip(devs, arr))
+
+
+def parse_netdev(netdev, devices=None):
+    # dev => int64 array of netstat_fields, devices - optional set of names to keep
+    rows = {}
+    nfields = len(netstat_fields)
     for line in netdev.strip().split("\n")[2:]:
-        adapter, data = line.split(":")
+        adapter, data = line.split(":", 1)
         adapter = adapter.strip()
-        assert adapter not in info
-        info[adapter] = NetStats(*map(int, data.split()))
+        if devices is None or adapter in devices:
+            assert adapter not in rows
+            rows[adapter] = data.split()[:nfields]
+    return stats_to_arrays(rows)
 
-    return info
 
-
-def parse_diskstats(diskstats):
-    info = {}
+def parse_diskstats(diskstats, devices=None):
+    # dev => int64 array of rusage_disk_fields, devices - optional set of names to keep
+    rows = {}
+    last_field = len(diskstat_fields)
     for line in diskstats.strip().split("\n"):
         data = line.split()
-        data_i = map(int, data[:2]) + [data[2]] + map(int, data[3:])
-        info[data[2].strip()] = DiskStats(*data_i)
-    return info
-
-
-def find(lst, check, default=None):
-    for obj in lst:
-        if check(obj):
-            return obj
-    return default
+        if devices is None or data[2] in devices:
+            rows[data[2]] = data[:2] + data[3:last_field]
+    return stats_to_arrays(rows)
+
+
+class RUsageLog(object):
+    def __init__(self, timestamps, fields, per_dev):
+        self.timestamps = timestamps
+        self.fields = fields
+        # dev => int64 array [snapshots, fields], absent samples are perf_store.MISSING
+        self.per_dev = per_dev
+
+    @classmethod
+    def from_snapshots(cls, snapshots, fields):
+        # snapshots - [(collect_time, {dev: array})] sorted by time
+        rows = len(snapshots)
+        per_dev = {}
+        for idx, (_, stats) in enumerate(snapshots):
+            for dev, vals in stats.items():
+                if dev not in per_dev:
+                    per_dev[dev] = numpy.empty((rows, len(fields)), dtype=numpy.int64)
+                    per_dev[dev].fill(perf_store.MISSING)
+                per_dev[dev][idx] = vals
+        return cls([collect_time for collect_time, _ in snapshots], fields, per_dev)
+
+    def __contains__(self, dev):
+        # device has first and last samples, so rates can be calculated
+        return dev in self.per_dev and \
+            self.per_dev[dev][0, 0] != perf_store.MISSING and \
+            self.per_dev[dev][-1, 0] != perf_store.MISSING
+
+    @property
+    def dtime(self):
+        return self.timestamps[-1] - self.timestamps[0]
+
+    def sample(self, dev, idx):
+        return dict(zip(self.fields, self.per_dev[dev][idx].tolist()))
+
+    def total_delta(self, dev):
+        arr = self.per_dev[dev]
+        return dict(zip(self.fields, (arr[-1] - arr[0]).tolist()))
 
 
 def load_performance_log_file(str_data, fields, skip=0, field_types=None):
     # first line - collection start time
-    lines = iter(str_data.split("\n"))
+    lines = iter_lines(str_data)
 
     # Mon Sep  7 21:08:26 UTC 2015
     sdate = datetime.datetime.strptime(next(lines), "%a %b %d %H:%M:%S UTC %Y")
     timestamp = (sdate - datetime.datetime(1970, 1, 1)).total_seconds()
 
-    per_dev = {}
+    # only tokens are collected per line, numbers are converted by numpy per device
+    per_dev_rows = collections.defaultdict(list)
+    last_field = skip + 1 + len(fields)
+    for line in lines:
+        items = line.split()
+        if items:
+            per_dev_rows[items[skip]].append(items[skip + 1:last_field])
 
-    if field_types is None:
-        fied_tr = functools.partial(map, float)
-    else:
-        def fied_tr(data):
-            return [func(val) for func, val in zip(field_types, data)]
+    per_dev = {}
+    for dev, rows in per_dev_rows.items():
+        if field_types is not None:
+            rows = [[func(val) for func, val in zip(field_types, row)] for row in rows]
+        per_dev[dev] = DevLoadLog(dev, timestamp, fields, numpy.array(rows, dtype=numpy.float64))
 
-    for line in lines:
-        line = line.strip()
-        if line == '':
-            continue
+    return per_dev
 
-        items = line.split()[skip:]
-        dev = items[0]
 
-        if dev not in per_dev:
-            per_dev[dev] = obj = DevLoadLog(dev, timestamp)
+class PGDistribution(object):
+    """
+    PG copies placement as dense matrix [osds, pools], rows are sorted
+    OSD ids, columns - sorted pool names. Only OSDs and pools, which
+    have at least one PG copy are included
+    """
+    def __init__(self, osd_ids, pool_names, matrix):
+        self.osd_ids = osd_ids
+        self.pool_names = pool_names
+        self.matrix = matrix
+
+        self.per_osd = matrix.sum(axis=1)
+        self.per_pool = matrix.sum(axis=0)
+
+        # per pool stats of PG copies count over OSDs
+        if matrix.shape[0] != 0:
+            self.pool_mean = matrix.mean(axis=0)
+            self.pool_std = matrix.std(axis=0)
+            self.pool_min = matrix.min(axis=0)
+            self.pool_max = matrix.max(axis=0)
         else:
-            obj = per_dev[items[0]]
+            self.pool_mean = self.pool_std = self.pool_min = self.pool_max = numpy.zeros(0)
 
-        obj.values.append(TabulaRasa(**dict(zip(fields, fied_tr(items[1:])))))
+    @classmethod
+    def from_placements(cls, osds, pools, pool_id2name):
+        # osds, pools - osd id and pool id for every PG copy
+        osd_ids, osd_idx = numpy.unique(numpy.array(osds, dtype=numpy.int64), return_inverse=True)
+        pool_ids, pool_idx = numpy.unique(numpy.array(pools, dtype=numpy.int64), return_inverse=True)
 
-    return per_dev
+        matrix = numpy.bincount(osd_idx * len(pool_ids) + pool_idx,
+                                minlength=len(osd_ids) * len(pool_ids))
+        matrix = matrix.reshape((len(osd_ids), len(pool_ids)))
 
+        pool_names = [pool_id2name[pool_id] for pool_id in pool_ids.tolist()]
+        order = sorted(range(len(pool_names)), key=pool_names.__getitem__)
+        return cls(osd_ids.tolist(),
+                   [pool_names[idx] for idx in order],
+                   matrix[:, order])
 
-class CephCluster(object):
-    def __init__(self, jstorage, storage):
-        self.osds = []
-        self.mons = []
-        self.pools = {}
-        self.hosts = {}
+    def pool_stats(self, pool_name):
+        # (mean, stddev, min, max) or None, if pool has no PG
+        if pool_name not in self.pool_names:
+            return None
+        idx = self.pool_names.index(pool_name)
+        return (float(self.pool_mean[idx]), float(self.pool_std[idx]),
+                int(self.pool_min[idx]), int(self.pool_max[idx]))
 
-        self.osd_tree = {}
-        self.osd_tree_root_id = None
-        self.report_collected_at_local = None
-        self.report_collected_at_gmt = None
 
-        self.cluster_net = None
-        self.public_net = None
+# cluster being loaded, for forked host loader workers
+_loader_cluster = None
+
+
+def _init_host_loader():
+    # forked worker shares open archive with parent, file offsets must not be shared
+    _loader_cluster.storage._index.reopen()
+
+
+def _load_host(host_name):
+    return _loader_cluster.load_host(host_name)
+
 
+# increase on any change in loaded model, cached models with other version are discarded
+CLUSTER_MODEL_VERSION = 9
+
+
+class CephCluster(object):
+    # section => attributes, which are set by load_<section> method. Sections are
+    # loaded on first access to any of attributes, so dependencies between them
+    # are resolved automatically, load() loads all of them at once
+    model_sections = [
+        ('osd_tree', ('osd_tree', 'osd_tree_root_id', 'osd_ids')),
+        ('PG_distribution', ('pg_distribution', 'sum_per_osd', 'sum_per_pool')),
+        ('osd_perf', ('osd_perf_by_id',)),
+        ('osds', ('osds', 'osd_by_id', 'osds_by_host', 'osds_by_device')),
+        ('cluster_networks', ('cluster_net', 'public_net')),
+        ('settings', ('settings',)),
+        ('pools', ('pools',)),
+        ('monitors', ('mons', 'mon_by_name')),
+        ('hosts', ('hosts',)),
+        ('status', ('report_collected_at_local', 'report_collected_at_gmt', 'report_collected_at_ts',
+                    'overall_status', 'health_summary', 'num_pgs', 'bytes_used', 'bytes_total',
+                    'bytes_avail', 'data_bytes', 'write_bytes_sec', 'op_per_sec', 'pgmap_stat')),
+        # fills load fields of osd devices and network adapters
+        ('usage', ()),
+    ]
+
+    section_by_attr = dict((attr, section) for section, attrs in model_sections for attr in attrs)
+
+    def __init__(self, jstorage, storage):
         self.storage = storage
         self.jstorage = jstorage
-        self.settings = TabulaRasa()
+        self.loaded_sections = set()
 
-    def get_alive_osd(self):
-        # try to find alive osd
-        for osd in self.osds:
-            if osd.status == 'up' and osd.daemon_runs:
-                return osd
-        return None
+        # if set - hosts are loaded with all heavy data, in process pool for large clusters
+        self.preload_hosts = False
+        self.load_workers = None
 
-    def load(self):
-        self.load_osd_tree()
-        self.load_PG_distribution()
-        self.load_osds()
-        self.load_cluster_networks()
-        self.load_pools()
-        self.load_monitors()
-        self.load_hosts()
+    def __getstate__(self):
+        # storages holds open files and caches, model is pickled without them
+        state = self.__dict__.copy()
+        state['storage'] = state['jstorage'] = None
+        return state
 
-        for host in self.hosts.values():
-            host.rusage_stats = self.get_rusage_stats(host.name)
-            host.perf_monitoring = self.get_perf_monitoring(host.name)
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.bind_loaders()
 
-        self.fill_io_devices_usage_stats()
-        self.fill_net_devices_usage_stats()
+    def __getattr__(self, name):
+        section = self.section_by_attr.get(name)
+        if section is None or section in self.__dict__.get('loaded_sections', ()):
+            raise AttributeError(name)
+        self.require(section)
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def require(self, section):
+        if section in self.loaded_sections:
+            return
+
+        # marked before load, so cyclic dependency fails with AttributeError instead of infinite recursion
+        self.loaded_sections.add(section)
+        try:
+            with stage('load_' + section):
+                getattr(self, 'load_' + section)()
+        except:
+            self.loaded_sections.discard(section)
+            raise
+
+    def bind_loaders(self):
+        # lazy fields loaders are not pickled, they are set again for loaded model objects
+        for osd in self.__dict__.get('osds', []):
+            osd.loader = self.load_osd_field
+            for dev_stat in (osd.data_stor_stats, osd.j_stor_stats):
+                if dev_stat is not None:
+                    dev_stat.loader = self.load_usage_field
+
+        for host in self.__dict__.get('hosts', {}).values():
+            host.loader = self.load_host_field
+            for net in [host.cluster_net, host.public_net] + list(host.net_adapters.values()):
+                if net is not None:
+                    net.loader = self.load_usage_field
+
+    def load_osd_field(self, osd, name):
+        assert name == 'config'
+        osd.config = self.jstorage.osd.get("{0}/config".format(osd.id))
+
+    def load_host_field(self, host, name):
+        with stage('load_host_' + name):
+            if name == 'hw_info':
+                host.hw_info = self.get_host_hw_info(host.name)
+            elif name == 'rusage_stats':
+                host.rusage_stats = self.get_rusage_stats(host.name, self.host_osd_devices(host.name),
+                                                          self.host_ceph_nics(host))
+            elif name == 'perf_monitoring':
+                host.perf_monitoring = self.get_perf_monitoring(host.name)
+
+    def load_usage_field(self, obj, name):
+        self.require('usage')
+
+    def osd_daemon_runs(self, osd_id):
+        data = self.storage.get('osd/{0}/osd_daemons'.format(osd_id))
+        if data is None:
+            return None
+
+        for line in data.split("\n"):
+            if 'ceph-osd' in line and '-i {0}'.format(osd_id) in line:
+                return True
+        return False
+
+    def get_alive_osd_id(self):
+        # try to find alive osd, only its files are read, if osds are not loaded yet
+        for osd_id in self.osd_ids:
+            if self.osd_tree[osd_id]['status'] == 'up' and self.osd_daemon_runs(osd_id):
+                return osd_id
+        return None
 
+    def load(self, workers=None):
+        self.preload_hosts = True
+        self.load_workers = workers
+        try:
+            for section, _ in self.model_sections:
+                self.require(section)
+        finally:
+            self.preload_hosts = False
+
+    def load_status(self):
         data = self.storage.get('master/collected_at')
         assert data is not None
         self.report_collected_at_local, \
-            self.report_collected_at_gmt, _ = data.strip().split("\n")
+            self.report_collected_at_gmt, collected_at_ts = data.strip().split("\n")
+        self.report_collected_at_ts = float(collected_at_ts)
 
         mstorage = self.jstorage.master
 
@@ -235,14 +560,20 @@ class CephCluster(object):
         self.write_bytes_sec = mstorage.status['pgmap'].get("write_bytes_sec", 0)
         self.op_per_sec = mstorage.status['pgmap'].get("op_per_sec", 0)
 
-        for osd in self.osds:
-            if osd.status == 'up':
-                self.settings.__dict__.update(osd.config)
+        self.pgmap_stat = mstorage.status['pgmap']
+
+    def load_settings(self):
+        for osd_id in self.osd_ids:
+            if self.osd_tree[osd_id]['status'] == 'up':
+                self.settings = Record()
+                self.settings.update(self.jstorage.osd.get("{0}/config".format(osd_id)))
                 break
         else:
             self.settings = None
 
-        self.pgmap_stat = mstorage.status['pgmap']
+    def load_usage(self):
+        self.fill_io_devices_usage_stats()
+        self.fill_net_devices_usage_stats()
 
     def fill_net_devices_usage_stats(self):
         for host in self.hosts.values():
@@ -251,6 +582,11 @@ class CephCluster(object):
             if perf_m is not None:
                 perf_m = perf_m.get('net')
 
+            # adapters without known load stay with None
+            for net in [host.cluster_net, host.public_net] + list(host.net_adapters.values()):
+                if net is not None:
+                    net.perf_stats_curr = None
+
             nets = [host.cluster_net, host.public_net] + \
                 [adapter for adapter in host.net_adapters.values()
                  if adapter.is_phy]
@@ -260,23 +596,20 @@ class CephCluster(object):
                     continue
 
                 if perf_m is not None and net.name in perf_m:
-                    sd = perf_m[net.name].values[0]
-                    ed = perf_m[net.name].values[-1]
-                    dtime = len(perf_m[net.name].values) - 1
-                elif host.rusage_stats is not None and 'net' in host.rusage_stats:
-                    start_time, start_data = host.rusage_stats['net'][0]
-                    end_time, end_data = host.rusage_stats['net'][-1]
-                    dtime = end_time - start_time
-                    sd = start_data[net.name]
-                    ed = end_data[net.name]
+                    delta = perf_m[net.name].total_delta()
+                    dtime = len(perf_m[net.name]) - 1
+                elif host.rusage_stats is not None and 'net' in host.rusage_stats and \
+                        net.name in host.rusage_stats['net']:
+                    dtime = host.rusage_stats['net'].dtime
+                    delta = host.rusage_stats['net'].total_delta(net.name)
                 else:
                     continue
 
-                net.perf_stats_curr = TabulaRasa()
-                net.perf_stats_curr.sbytes = (ed.sbytes - sd.sbytes) / dtime
-                net.perf_stats_curr.rbytes = (ed.rbytes - sd.rbytes) / dtime
-                net.perf_stats_curr.spackets = (ed.spackets - sd.spackets) / dtime
-                net.perf_stats_curr.rpackets = (ed.rpackets - sd.rpackets) / dtime
+                net.perf_stats_curr = NetLoad()
+                net.perf_stats_curr.sbytes = delta['sbytes'] / dtime
+                net.perf_stats_curr.rbytes = delta['rbytes'] / dtime
+                net.perf_stats_curr.spackets = delta['spackets'] / dtime
+                net.perf_stats_curr.rpackets = delta['rpackets'] / dtime
 
     def fill_io_devices_usage_stats(self):
         for osd in self.osds:
@@ -286,12 +619,7 @@ class CephCluster(object):
             if perf_m is not None:
                 perf_m = perf_m.get('io')
 
-            if 'disk' in host.rusage_stats:
-                start_time, start_data = host.rusage_stats['disk'][0]
-                end_time, end_data = host.rusage_stats['disk'][-1]
-                rusage_dtime = end_time - start_time
-            else:
-                dtime = end_data = start_data = None
+            rusage = host.rusage_stats.get('disk')
 
             for dev_stat in (osd.data_stor_stats, osd.j_stor_stats):
                 if dev_stat is None:
@@ -299,22 +627,22 @@ class CephCluster(object):
 
                 dev = os.path.basename(dev_stat.root_dev)
                 if perf_m is not None and dev in perf_m:
-                    sd = perf_m[dev].values[0]
-                    ed = perf_m[dev].values[-1]
-                    dtime = len(perf_m[dev].values) - 1
-                elif start_data is not None and dev in start_data:
-                    dtime = rusage_dtime
-                    sd = start_data[dev]
-                    ed = end_data[dev]
+                    sd = perf_m[dev].sample(0)
+                    delta = perf_m[dev].total_delta()
+                    dtime = len(perf_m[dev]) - 1
+                elif rusage is not None and dev in rusage:
+                    dtime = rusage.dtime
+                    sd = rusage.sample(dev, 0)
+                    delta = rusage.total_delta(dev)
                 else:
                     continue
 
-                dev_stat.read_bytes_curr = (ed.sectors_read - sd.sectors_read) * 512 / dtime
-                dev_stat.write_bytes_curr = (ed.sectors_written - sd.sectors_written) * 512 / dtime
-                dev_stat.read_iops_curr = (ed.reads_completed - sd.reads_completed) / dtime
-                dev_stat.write_iops_curr = (ed.writes_completed - sd.writes_completed) / dtime
-                dev_stat.io_time_curr = 0.001 * (ed.io_time - sd.io_time) / dtime
-                dev_stat.w_io_time_curr = 0.001 * (ed.weighted_io_time - sd.weighted_io_time) / dtime
+                dev_stat.read_bytes_curr = delta['sectors_read'] * 512 / dtime
+                dev_stat.write_bytes_curr = delta['sectors_written'] * 512 / dtime
+                dev_stat.read_iops_curr = delta['reads_completed'] / dtime
+                dev_stat.write_iops_curr = delta['writes_completed'] / dtime
+                dev_stat.io_time_curr = 0.001 * delta['io_time'] / dtime
+                dev_stat.w_io_time_curr = 0.001 * delta['weighted_io_time'] / dtime
 
                 # derived stats
                 dev_stat.iops_curr = dev_stat.read_iops_curr + dev_stat.write_iops_curr
@@ -325,24 +653,25 @@ class CephCluster(object):
                 else:
                     dev_stat.lat_curr = 0
 
-                dev_stat.read_bytes_uptime = (sd.sectors_read) * 512 / host.uptime
-                dev_stat.write_bytes_uptime = (sd.sectors_written) * 512 / host.uptime
-                dev_stat.read_iops_uptime = sd.reads_completed / host.uptime
-                dev_stat.write_iops_uptime = (sd.writes_completed) / host.uptime
-                dev_stat.io_time_uptime = 0.001 * sd.io_time / host.uptime
-                dev_stat.w_io_time_uptime = 0.001 * sd.weighted_io_time / host.uptime
+                dev_stat.read_bytes_uptime = sd['sectors_read'] * 512 / host.uptime
+                dev_stat.write_bytes_uptime = sd['sectors_written'] * 512 / host.uptime
+                dev_stat.read_iops_uptime = sd['reads_completed'] / host.uptime
+                dev_stat.write_iops_uptime = sd['writes_completed'] / host.uptime
+                dev_stat.io_time_uptime = 0.001 * sd['io_time'] / host.uptime
+                dev_stat.w_io_time_uptime = 0.001 * sd['weighted_io_time'] / host.uptime
 
     def load_cluster_networks(self):
         self.cluster_net = None
         self.public_net = None
 
-        osd = self.get_alive_osd()
-        if osd is not None:
-            cluster_net_str = osd.config.get('cluster_network')
+        osd_id = self.get_alive_osd_id()
+        if osd_id is not None:
+            config = self.jstorage.osd.get("{0}/config".format(osd_id))
+            cluster_net_str = config.get('cluster_network')
             if cluster_net_str is not None and cluster_net_str != "":
                 self.cluster_net = IPNetwork(cluster_net_str)
 
-            public_net_str = osd.config.get('public_network', None)
+            public_net_str = config.get('public_network', None)
             if public_net_str is not None and public_net_str != "":
                 self.public_net = IPNetwork(public_net_str)
 
@@ -351,97 +680,138 @@ class CephCluster(object):
 
         self.osd_tree_root_id = nodes[0]['id']
         self.osd_tree = dict((node['id'], node) for node in nodes)
+        self.osd_ids = sorted(node['id'] for node in nodes if node['type'] == 'osd')
+
+        # Breadth-first walk from all roots, parents are filled before children.
+        # Per node sets: parent - parent id, host - name of host above node,
+        # root - root id, ancestors - type => id of closest ancestor of this type
+        # (dict is shared between siblings), subtree_weight/subtree_osds - sum of
+        # osd crush weights and osd count in subtree
+        child_ids = set(child_id for node in nodes for child_id in node.get('children', []))
+        order = [node for node in nodes if node['id'] not in child_ids]
+        for node in order:
+            node['parent'] = None
+            node['host'] = None
+            node['root'] = node['id']
+            node['ancestors'] = {}
+
+        visited = set(node['id'] for node in order)
+        pos = 0
+        while pos < len(order):
+            node = order[pos]
+            pos += 1
+
+            if 'children' not in node:
+                continue
+
+            host = node['name'] if node['type'] == 'host' else node['host']
+            ancestors = node['ancestors'].copy()
+            ancestors[node['type']] = node['id']
+
+            for child_id in node['children']:
+                if child_id in visited:
+                    continue
+                visited.add(child_id)
+                child = self.osd_tree[child_id]
+                child['parent'] = node['id']
+                child['host'] = host
+                child['root'] = node['root']
+                child['ancestors'] = ancestors
+                order.append(child)
+
+        for node in order:
+            if node['type'] == 'osd':
+                node['subtree_weight'] = float(node.get('crush_weight', 0))
+                node['subtree_osds'] = 1
+            else:
+                node['subtree_weight'] = 0.0
+                node['subtree_osds'] = 0
 
-        # set backtrack links
-        def fill_parent(obj, parent_id=None):
-            obj['parent'] = parent_id
-            if 'children' in obj:
-                for child_id in obj['children']:
-                    fill_parent(self.osd_tree[child_id], obj['id'])
-
-        # set hosts
-        def fill_host(obj, host=None):
-            obj['host'] = host
-            if obj['type'] == 'host':
-                host = obj['name']
-            if 'children' in obj:
-                for child_id in obj['children']:
-                    fill_host(self.osd_tree[child_id], host)
-
-        fill_parent(self.osd_tree[self.osd_tree_root_id])
-        fill_host(self.osd_tree[self.osd_tree_root_id])
+        for node in reversed(order):
+            if node['parent'] is not None:
+                parent = self.osd_tree[node['parent']]
+                parent['subtree_weight'] += node['subtree_weight']
+                parent['subtree_osds'] += node['subtree_osds']
 
     def find_host_for_node(self, node):
-        cnode = node
-        while cnode['type'] != 'host':
-            if cnode['parent'] is None:
-                raise IndexError("Can't found host for " + str(node['id']))
-            cnode = self.osd_tree[cnode['parent']]
-        return cnode
+        if node['type'] == 'host':
+            return node
+        host_id = node['ancestors'].get('host')
+        if host_id is None:
+            raise IndexError("Can't found host for " + str(node['id']))
+        return self.osd_tree[host_id]
+
+    def load_osd_perf(self):
+        self.osd_perf_by_id = dict((info['id'], info['perf_stats'])
+                                   for info in self.jstorage.master.osd_perf["osd_perf_infos"])
 
     def load_osds(self):
+        self.osds = []
         for node in self.osd_tree.values():
             if node['type'] != 'osd':
                 continue
 
             osd = CephOSD()
             self.osds.append(osd)
-            osd.__dict__.update(node)
+            osd.update(node)
             osd.host = node['host']
 
             try:
                 osd_data = getattr(self.jstorage.osd, str(node['id']))
-                osd.data_stor_stats = TabulaRasa(**osd_data.data.stats)
-                osd.j_stor_stats = TabulaRasa(**osd_data.journal.stats)
+                osd.data_stor_stats = DevStats(**osd_data.data.stats)
+                osd.j_stor_stats = DevStats(**osd_data.journal.stats)
             except AttributeError:
                 osd.data_stor_stats = None
                 osd.j_stor_stats = None
 
-            osd.osd_perf = find(self.jstorage.master.osd_perf["osd_perf_infos"],
-                                lambda x: x['id'] == osd.id)["perf_stats"]
-
-            data = self.storage.get('osd/{0}/osd_daemons'.format(osd.id))
-            if data is None:
-                osd.daemon_runs = None
-            else:
-                for line in data.split("\n"):
-                    if 'ceph-osd' in line and '-i {0}'.format(osd.id) in line:
-                        osd.daemon_runs = True
-                        break
-                else:
-                    osd.daemon_runs = False
-
-            data = self.storage.get('osd/{0}/osd_daemons'.format(osd.id))
+            osd.osd_perf = self.osd_perf_by_id.get(osd.id)
+            osd.daemon_runs = self.osd_daemon_runs(osd.id)
 
             if self.sum_per_osd is not None:
                 osd.pg_count = self.sum_per_osd[osd.id]
             else:
                 osd.pg_count = None
 
-            osd.config = self.jstorage.osd.get("{0}/config".format(osd.id))
-
         self.osds.sort(key=lambda x: x.id)
+        self.index_osds()
+        self.bind_loaders()
+
+    def index_osds(self):
+        self.osd_by_id = {}
+        self.osds_by_host = {}
+        self.osds_by_device = {}
+
+        for osd in self.osds:
+            self.osd_by_id[osd.id] = osd
+            self.osds_by_host.setdefault(osd.host, []).append(osd)
+
+            # device names are unique only within host
+            for dev in self.osd_devices(osd):
+                self.osds_by_device.setdefault((osd.host, dev), []).append(osd)
 
     def load_pools(self):
         self.pools = {}
 
-        for pool_part in self.jstorage.master.osd_dump['pools']:
+        for pool_part in self.jstorage.iter_records('master/osd_dump', 'pools'):
             pool = Pool()
             pool.id = pool_part['pool']
             pool.name = pool_part['pool_name']
-            pool.__dict__.update(pool_part)
+            pool.update(pool_part)
             self.pools[int(pool.id)] = pool
 
         for pool_part in self.jstorage.master.rados_df['pools']:
             if 'categories' not in pool_part:
-                self.pools[int(pool_part['id'])].__dict__.update(pool_part)
+                self.pools[int(pool_part['id'])].update(pool_part)
             else:
                 assert len(pool_part['categories']) == 1
                 cat = pool_part['categories'][0].copy()
                 del cat['name']
-                self.pools[int(pool_part['id'])].__dict__.update(cat)
+                self.pools[int(pool_part['id'])].update(cat)
 
     def load_monitors(self):
+        self.mons = []
+        self.mon_by_name = {}
+
         srv_health = self.jstorage.master.status['health']['health']['health_services']
         assert len(srv_health) == 1
         for srv in srv_health[0]['mons']:
@@ -452,26 +822,45 @@ class CephCluster(object):
             mon.kb_avail = srv["kb_avail"]
             mon.avail_percent = srv["avail_percent"]
             self.mons.append(mon)
+            self.mon_by_name[mon.name] = mon
+
+    @staticmethod
+    def osd_devices(osd):
+        return set(os.path.basename(dev_stat.root_dev)
+                   for dev_stat in (osd.data_stor_stats, osd.j_stor_stats)
+                   if dev_stat is not None)
 
-    def get_node_net_stats(self, host_name):
-        return parse_netdev(self.storage.get('hosts/{0}/netdev'.format(host_name)))
+    def host_osd_devices(self, host_name):
+        devs = set()
+        for osd in self.osds_by_host.get(host_name, []):
+            devs.update(self.osd_devices(osd))
+        return devs
 
-    def get_node_disk_stats(self, host_name):
-        return parse_netdev(self.storage.get('hosts/{0}/diskstats'.format(host_name)))
+    @staticmethod
+    def host_ceph_nics(host):
+        nets = [host.cluster_net, host.public_net] + list(host.net_adapters.values())
+        return set(net.name for net in nets if net is not None and net.name is not None)
+
+    def get_node_net_stats(self, host_name, devices=None):
+        return parse_netdev(self.storage.get('hosts/{0}/netdev'.format(host_name)), devices)
+
+    def get_node_disk_stats(self, host_name, devices=None):
+        return parse_diskstats(self.storage.get('hosts/{0}/diskstats'.format(host_name)), devices)
 
     def load_PG_distribution(self):
         try:
-            pg_dump = self.jstorage.master.pg_dump
+            pg_stats = self.jstorage.iter_records('master/pg_dump', 'pg_stats', ('pgid', 'acting'))
         except AttributeError:
-            pg_dump = None
+            pg_stats = None
 
-        self.osd_pool_pg_2d = collections.defaultdict(lambda: collections.Counter())
-        self.sum_per_pool = collections.Counter()
-        self.sum_per_osd = collections.Counter()
         pool_id2name = dict((dt['poolnum'], dt['poolname'])
                             for dt in self.jstorage.master.osd_lspools)
 
-        if pg_dump is None:
+        # one item per PG copy
+        osds = []
+        pools = []
+
+        if pg_stats is None:
             pg_re = re.compile(r"(?P<pool_id>[0-9a-f]+)\.(?P<pg_id>[0-9a-f]+)_head$")
             for node in self.osd_tree.values():
                 if node['type'] == 'osd':
@@ -479,21 +868,20 @@ class CephCluster(object):
                     storage_ls = self.storage.get('osd/{0}/storage_ls'.format(osd_num))
                     for pg in storage_ls.split():
                         mobj = pg_re.match(pg)
-                        if mobj is None:
-                            continue
-
-                        pool_name = pool_id2name[int(mobj.group('pool_id'))]
-                        self.osd_pool_pg_2d[osd_num][pool_name] += 1
-                        self.sum_per_pool[pool_name] += 1
-                        self.sum_per_osd[osd_num] += 1
+                        if mobj is not None:
+                            osds.append(osd_num)
+                            pools.append(int(mobj.group('pool_id')))
         else:
-            for pg in pg_dump['pg_stats']:
+            for pg in pg_stats:
                 pool = int(pg['pgid'].split('.', 1)[0])
-                for osd_num in pg['acting']:
-                    pool_name = pool_id2name[pool]
-                    self.osd_pool_pg_2d[osd_num][pool_name] += 1
-                    self.sum_per_pool[pool_name] += 1
-                    self.sum_per_osd[osd_num] += 1
+                osds.extend(pg['acting'])
+                pools.extend([pool] * len(pg['acting']))
+
+        self.pg_distribution = PGDistribution.from_placements(osds, pools, pool_id2name)
+        self.sum_per_osd = collections.Counter(dict(zip(self.pg_distribution.osd_ids,
+                                                        self.pg_distribution.per_osd.tolist())))
+        self.sum_per_pool = collections.Counter(dict(zip(self.pg_distribution.pool_names,
+                                                         self.pg_distribution.per_pool.tolist())))
 
     def parse_meminfo(self, meminfo):
         info = {}
@@ -512,88 +900,155 @@ class CephCluster(object):
             info[name] = val
         return info
 
-    def load_hosts(self):
-        for host_name in self.storage.hosts[2]:
-            stor_node = self.storage.get("hosts/" + host_name, expected_format=None)
-
-            host = Host(host_name)
-            self.hosts[host.name] = host
-
-            lshw_xml = stor_node.get('lshw', expected_format='xml')
+    # hosts are loaded in process pool only if there are enough of them
+    parallel_min_hosts = 16
 
-            if lshw_xml is None:
-                host.hw_info = None
-            else:
-                try:
-                    host.hw_info = get_hw_info(lshw_xml)
-                except:
-                    host.hw_info = None
-
-            info = self.parse_meminfo(stor_node.get('meminfo'))
-            host.mem_total = info['MemTotal']
-            host.mem_free = info['MemFree']
-            host.swap_total = info['SwapTotal']
-            host.swap_free = info['SwapFree']
-            loadavg = stor_node.get('loadavg')
-
-            host.load_5m = None if loadavg is None else float(loadavg.strip().split()[1])
-
-            ipa = self.storage.get('hosts/%s/ipa' % host.name)
-            ip_rr_s = r"\d+:\s+(?P<adapter>.*?)\s+inet\s+(?P<ip>\d+\.\d+\.\d+\.\d+)/(?P<size>\d+)"
+    def load_hosts(self):
+        global _loader_cluster
 
-            info = collections.defaultdict(lambda: [])
-            for line in ipa.split("\n"):
-                match = re.match(ip_rr_s, line)
-                if match is not None:
-                    info[match.group('adapter')].append(
-                        (IPAddress(match.group('ip')), int(match.group('size'))))
+        self.hosts = {}
 
-            for adapter, ips_with_sizes in info.items():
-                for ip, sz in ips_with_sizes:
-                    if self.public_net is not None and ip in self.public_net:
-                        host.public_net = NetworkAdapter(adapter, ip)
+        # sorted, so merged result doesn't depend on workers count
+        host_names = sorted(self.storage.hosts[2])
+        workers = self.load_workers
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = min(workers, len(host_names))
+
+        # only heavy data is worth loading in parallel,
+        # daemonic processes (like fleet workers) can't have children
+        if not self.preload_hosts or workers <= 1 or len(host_names) < self.parallel_min_hosts or \
+                multiprocessing.current_process().daemon:
+            hosts = map(self.load_host, host_names)
+        else:
+            # sections, used by host loading, are loaded once, before fork
+            self.require('osds')
+            self.require('cluster_networks')
 
-                    if self.cluster_net is not None and ip in self.cluster_net:
-                        host.cluster_net = NetworkAdapter(adapter, ip)
+            _loader_cluster = self
+            pool = multiprocessing.Pool(workers, initializer=_init_host_loader)
+            try:
+                hosts = pool.map(_load_host, host_names, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+                _loader_cluster = None
 
-            interfaces = getattr(self.jstorage.hosts, host_name).interfaces
-            for name, adapter_dct in interfaces.items():
-                adapter_dct = adapter_dct.copy()
+        for host in hosts:
+            self.hosts[host.name] = host
 
-                dev = adapter_dct.pop('dev')
-                adapter = NetworkAdapter(dev, None)
-                adapter.__dict__.update(adapter_dct)
-                host.net_adapters[dev] = adapter
+        self.bind_loaders()
 
-            net_stats = self.get_node_net_stats(host.name)
-            perf_adapters = [host.cluster_net, host.public_net] + list(host.net_adapters.values())
+    def get_host_hw_info(self, host_name):
+        lshw_xml = self.storage.get("hosts/{0}/lshw".format(host_name), expected_format='xml')
+        if lshw_xml is None:
+            return None
 
-            for net in perf_adapters:
-                if net is not None and net.name is not None:
-                    net.perf_stats = net_stats.get(net.name)
+        try:
+            with parse_timer(self.storage, "hosts/{0}/lshw".format(host_name)):
+                return get_hw_info(lshw_xml)
+        except:
+            return None
+
+    def load_host(self, host_name):
+        # host object must be picklable, it's passed back from pool workers
+        stor_node = self.storage.get("hosts/" + host_name, expected_format=None)
+
+        host = Host(host_name)
+
+        info = self.parse_meminfo(stor_node.get('meminfo'))
+        host.mem_total = info['MemTotal']
+        host.mem_free = info['MemFree']
+        host.swap_total = info['SwapTotal']
+        host.swap_free = info['SwapFree']
+        loadavg = stor_node.get('loadavg')
+
+        host.load_5m = None if loadavg is None else float(loadavg.strip().split()[1])
+
+        ipa = self.storage.get('hosts/%s/ipa' % host.name)
+        ip_rr_s = r"\d+:\s+(?P<adapter>.*?)\s+inet\s+(?P<ip>\d+\.\d+\.\d+\.\d+)/(?P<size>\d+)"
+
+        info = collections.defaultdict(lambda: [])
+        for line in ipa.split("\n"):
+            match = re.match(ip_rr_s, line)
+            if match is not None:
+                info[match.group('adapter')].append(
+                    (IPAddress(match.group('ip')), int(match.group('size'))))
+
+        for adapter, ips_with_sizes in info.items():
+            for ip, sz in ips_with_sizes:
+                if self.public_net is not None and ip in self.public_net:
+                    host.public_net = NetworkAdapter(adapter, ip)
+
+                if self.cluster_net is not None and ip in self.cluster_net:
+                    host.cluster_net = NetworkAdapter(adapter, ip)
+
+        interfaces = getattr(self.jstorage.hosts, host_name).interfaces
+        for name, adapter_dct in interfaces.items():
+            adapter_dct = adapter_dct.copy()
+
+            dev = adapter_dct.pop('dev')
+            adapter = NetworkAdapter(dev, None)
+            adapter.update(adapter_dct)
+            host.net_adapters[dev] = adapter
+
+        net_stats = self.get_node_net_stats(host.name, self.host_ceph_nics(host))
+        perf_adapters = [host.cluster_net, host.public_net] + list(host.net_adapters.values())
+
+        for net in perf_adapters:
+            if net is not None and net.name in net_stats:
+                net.perf_stats = NetStats(*net_stats[net.name].tolist())
+
+        host.uptime = float(stor_node.get('uptime').split()[0])
+
+        hw_cache_info = stor_node.get('hw_cache', expected_format='json')
+        if hw_cache_info is not None:
+            host.hw_cache_info = json.loads(hw_cache_info)
+
+        if self.preload_hosts:
+            for name in host.lazy_fields:
+                self.load_host_field(host, name)
+
+        return host
+
+    def get_rusage_stats(self, host_name, disks=None, nics=None):
+        # stat_type => RUsageLog, only devices from disks/nics are loaded, if given
+        stats = {}
+        formats = {'disk': (parse_diskstats, rusage_disk_fields, disks),
+                   'net': (parse_netdev, netstat_fields, nics)}
+
+        columnar = self.storage.get(perf_store.COLUMNAR_ROOT + "/rusage/" + host_name,
+                                    expected_format=None)
+        if columnar is not None:
+            for stat_type, (_, fields, devices) in formats.items():
+                data = columnar.get_buffer(stat_type, expected_format='cdat')
+                if data is None:
+                    continue
 
-            host.uptime = float(stor_node.get('uptime').split()[0])
+                table = perf_store.load(data)
+                per_dev = {}
+                for idx, dev in enumerate(table.devices):
+                    if devices is None or dev in devices:
+                        per_dev[dev] = numpy.column_stack([table.data[field][idx] for field in fields])
+                stats[stat_type] = RUsageLog([int(ts) for ts in table.timestamps], fields, per_dev)
+            return stats
 
-    def get_rusage_stats(self, host_name):
-        stats = collections.defaultdict(lambda: [])
         host_stats = self.storage.get("rusage/" + host_name, expected_format=None)
         if host_stats is None:
             return {}
 
+        snapshots = collections.defaultdict(list)
         for stat_name in host_stats:
             collect_time, stat_type = stat_name.split("-")
-
-            if stat_type == 'disk':
-                stat = parse_diskstats(host_stats.get(stat_name))
-            elif stat_type == 'net':
-                stat = parse_netdev(host_stats.get(stat_name))
-            else:
+            if stat_type not in formats:
                 raise ValueError("Unknown stat type - {!r}".format(stat_type))
 
-            stats[stat_type].append([int(collect_time), stat])
+            parser, _, devices = formats[stat_type]
+            snapshots[stat_type].append((int(collect_time), parser(host_stats.get(stat_name), devices)))
 
-        for stat_list in stats.values():
+        for stat_type, stat_list in snapshots.items():
             stat_list.sort()
+            stats[stat_type] = RUsageLog.from_snapshots(stat_list, formats[stat_type][1])
 
         return stats
 
@@ -602,31 +1057,19 @@ class CephCluster(object):
 
         res = {}
 
-        for name, fields, skip in [('io', diskstat_fields[3:], 2),
-                                   ('net', netstat_fields, 0)]:
-            stats_s = self.storage.get(path + name)
-            if stats_s is not None:
-                res[name] = load_performance_log_file(stats_s, fields, skip)
-
-        # mp_pool = MPExecutorPool(processes=2)
-        # futures = {}
-        # futures[name] = mp_pool.apply_async(load_performance_log_file,
-        #                                     [stats_s, fields, skip])
-        # for name, future in futures.items():
-        #     res[name] = future.get()
-
-        def to_seconds(val):
-            if '-' in val:
-                days, rest = val.split('-')
-            else:
-                days, rest = 0, val
-
-            h, m, s = map(int, rest.split(":"))
-            return int(days) * 24 * 3600 + h * 3600 + m * 60 + s
+        for name, fields, skip, field_types in perf_log_formats:
+            table = self.storage.get_buffer(perf_store.COLUMNAR_ROOT + "/" + path + name,
+                                            expected_format='cdat')
+            if table is not None:
+                with parse_timer(self.storage, perf_store.COLUMNAR_ROOT + "/" + path + name):
+                    table = perf_store.load(table)
+                res[name] = dict((dev, DevLoadLog(dev, table.start, table.fields, table.device_array(dev)))
+                                 for dev in table.devices)
+                continue
 
-        stats_s = self.storage.get(path + 'cpu')
-        if stats_s is not None:
-            res['cpu'] = load_performance_log_file(stats_s, ['pid', 'cpu'], 0,
-                                                   [to_seconds])
+            stats_s = self.storage.get_buffer(path + name)
+            if stats_s is not None:
+                with parse_timer(self.storage, path + name):
+                    res[name] = load_performance_log_file(stats_s, fields, skip, field_types)
 
         return res
@@ -5,6 +5,7 @@ import json
 import uuid
 import Queue
 import shutil
+import hashlib
 import logging
 import os.path
 import argparse
@@ -32,7 +33,8 @@ class CollectSettings(object):
         return True
 
 
-def check_output(cmd, log=True):
+def check_output(cmd, log=True, strict=False):
+    # strict - report non-zero exit code as failure
     if log:
         logger.debug("CMD: %r", cmd)
 
@@ -45,16 +47,16 @@ def check_output(cmd, log=True):
     if 0 == code:
         return True, out[0]
     else:
-        return True, out[0] + out[1]
+        return not strict, out[0] + out[1]
 
 
 SSH_OPTS = "-o LogLevel=quiet -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null "
 SSH_OPTS += "-o ConnectTimeout=20"
 # add timeouts
 
-def check_output_ssh(host, opts, cmd):
+def check_output_ssh(host, opts, cmd, strict=False):
     logger.debug("SSH:%s: %r", host, cmd)
-    return check_output("ssh {2} {0} {1}".format(host, cmd, SSH_OPTS), False)
+    return check_output("ssh {2} {0} {1}".format(host, cmd, SSH_OPTS), False, strict)
 
 
 def get_device_for_file(host, opts, fname):
@@ -80,14 +82,176 @@ def get_device_for_file(host, opts, fname):
     return root_dev, dev
 
 
+class HWInfoCache(object):
+    """
+    Local cache for slow and rarely changed hardware inventory outputs
+    (lshw, dmidecode, hdparm, smartctl). Entry is valid while host boot id
+    and block devices serials are the same and it is not older than max_age
+    """
+    # quoted, so whole command runs on target host, not split by local shell
+    key_cmd = "'cat /proc/sys/kernel/random/boot_id ; ls -1 /dev/disk/by-id'"
+
+    def __init__(self, opts, cache_dir, max_age):
+        self.opts = opts
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.host_keys = {}
+        self.host_locks = collections.defaultdict(threading.Lock)
+
+        # (host, item) stored during this run, they are not reported as cached
+        self.stored = set()
+
+        # host => {item => {'cached': bool, 'collected_at': ts, 'age': sec}}
+        self.freshness = collections.defaultdict(lambda: {})
+
+    def get_host_key(self, host):
+        with self.lock:
+            host_lock = self.host_locks[host]
+
+        # key is computed once per host, other threads wait for it
+        with host_lock:
+            if host not in self.host_keys:
+                self.host_keys[host] = self.calc_host_key(host)
+            return self.host_keys[host]
+
+    def calc_host_key(self, host):
+        ok, out = check_output_ssh(host, self.opts, self.key_cmd)
+        lines = out.strip().split("\n") if ok else []
+
+        # boot_id is an uuid, anything else means that command failed
+        if len(lines) == 0 or len(lines[0].strip()) != 36:
+            logger.warning("Can't get boot_id for node %s, hw info cache disabled for it", host)
+            key = None
+        else:
+            boot_id = lines[0].strip()
+            serials = sorted(line.strip() for line in lines[1:])
+            key = hashlib.md5("\n".join([host, boot_id] + serials)).hexdigest()
+
+        return key
+
+    def get_fname(self, host, item):
+        return os.path.join(self.cache_dir, host,
+                            item.replace('/', '_').replace(' ', '_') + '.json')
+
+    def get(self, host, item):
+        key = self.get_host_key(host)
+        if key is None:
+            return None
+
+        fname = self.get_fname(host, item)
+        if not os.path.exists(fname):
+            return None
+
+        try:
+            entry = json.load(open(fname))
+        except (IOError, ValueError):
+            logger.warning("Broken hw info cache file %r", fname)
+            return None
+
+        age = time.time() - entry['collected_at']
+        if entry['key'] != key or age > self.max_age:
+            return None
+
+        with self.lock:
+            if (host, item) not in self.stored:
+                self.freshness[host][item] = {'cached': True,
+                                              'collected_at': entry['collected_at'],
+                                              'age': int(age)}
+        return entry['data'].encode('utf8')
+
+    def put(self, host, item, data):
+        now = time.time()
+        with self.lock:
+            self.stored.add((host, item))
+            self.freshness[host][item] = {'cached': False,
+                                          'collected_at': now,
+                                          'age': 0}
+
+        key = self.get_host_key(host)
+        if key is None:
+            return
+
+        fname = self.get_fname(host, item)
+        try:
+            if not os.path.exists(os.path.dirname(fname)):
+                os.makedirs(os.path.dirname(fname))
+
+            # write + rename, so concurrent readers never see partial file
+            tmp_fname = "{0}.{1}.tmp".format(fname, uuid.uuid4())
+            with open(tmp_fname, "w") as fd:
+                json.dump({'key': key, 'collected_at': now, 'data': data.decode('utf8')}, fd)
+            os.rename(tmp_fname, fname)
+        except UnicodeDecodeError:
+            logger.warning("Output of %r for node %s isn't utf8 and wouldn't be cached", item, host)
+        except (IOError, OSError):
+            logger.exception("Can't store hw info cache file %r", fname)
+
+
+# (cmd substring, (estimated seconds, estimated output bytes)), first match is used.
+# Only for --dry-run plan estimation, numbers are rough
+CMD_COSTS = [
+    ("lshw", (5.0, 100 * 1024)),
+    ("dmidecode", (1.0, 30 * 1024)),
+    ("netstat", (1.0, 50 * 1024)),
+    ("tail -n", (0.5, 100 * 1024)),
+    ("pg dump", (5.0, 8 * 1024 ** 2)),
+    ("auth list", (1.0, 20 * 1024)),
+    ("ceph ", (1.0, 10 * 1024)),
+    ("rados ", (1.0, 10 * 1024)),
+]
+
+DEFAULT_CMD_COST = (0.3, 4 * 1024)
+
+
+def estimate_cost(cmd):
+    for pattern, cost in CMD_COSTS:
+        if pattern in cmd:
+            return cost
+    return DEFAULT_CMD_COST
+
+
+class PlanItem(object):
+    """
+    Single step of collection plan. Without func - shell command, executed
+    locally (host is None) or over ssh, output is stored into every path
+    in paths. With func - collector method, for steps, which depends on
+    data from node. For such items cmd is only a description
+    """
+    def __init__(self, collector, host, path, cmd, frmt='txt',
+                 func=None, args=(), kwargs=None, cost=None, hw_cache_item=None):
+        self.collector = collector
+        self.host = host
+        self.paths = [path]
+        self.cmd = cmd
+        self.frmt = frmt
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.cost = cost if cost is not None else estimate_cost(cmd)
+        self.hw_cache_item = hw_cache_item
+
+    def key(self):
+        if self.func is None:
+            return (self.host, self.cmd, self.frmt, self.hw_cache_item)
+        return (self.host, self.cmd, self.paths[0])
+
+    def run(self):
+        if self.func is not None:
+            self.func(*self.args, **self.kwargs)
+        else:
+            self.collector.run_plan_item(self)
+
+
 class Collector(object):
     name = None
     run_alone = False
 
-    def __init__(self, opts, collect_settings, res_q):
+    def __init__(self, opts, collect_settings, res_q, hw_cache=None):
         self.collect_settings = collect_settings
         self.opts = opts
         self.res_q = res_q
+        self.hw_cache = hw_cache
 
     def run2emit(self, path, format, cmd, check=True):
         if check:
@@ -107,14 +271,61 @@ class Collector(object):
             logger.warning("Cmd {0} failed on node {1}".format(cmd, host))
         self.emit(path, format, ok, out, check=False)
 
+    def cached_check_output_ssh(self, host, cmd, item):
+        if self.hw_cache is not None:
+            out = self.hw_cache.get(host, item)
+            if out is not None:
+                logger.debug("Use cached %r for node %s", item, host)
+                return True, out
+
+        # failed output is not cached, but reported same way as for uncached commands
+        ok, out = check_output_ssh(host, self.opts, cmd, strict=True)
+        if ok and self.hw_cache is not None:
+            self.hw_cache.put(host, item, out)
+        return True, out
+
+    def cached_ssh2emit(self, host, path, format, cmd, item, check=True):
+        if check:
+            if not self.collect_settings.allowed(path):
+                return
+
+        ok, out = self.cached_check_output_ssh(host, cmd, item)
+        if not ok:
+            logger.warning("Cmd {0} failed on node {1}".format(cmd, host))
+        self.emit(path, format, ok, out, check=False)
+
+    def run_plan_item(self, item):
+        if item.host is None:
+            ok, out = check_output(item.cmd)
+        elif item.hw_cache_item is not None:
+            ok, out = self.cached_check_output_ssh(item.host, item.cmd, item.hw_cache_item)
+        else:
+            ok, out = check_output_ssh(item.host, self.opts, item.cmd)
+
+        if not ok:
+            logger.warning("Cmd {0} failed on node {1}".format(item.cmd, item.host))
+
+        for path in item.paths:
+            self.emit(path, item.frmt, ok, out, check=False)
+
+    def cmd_item(self, host, path, cmd, frmt='txt', hw_cache_item=None):
+        return PlanItem(self, host, path, cmd, frmt, hw_cache_item=hw_cache_item)
+
+    def task_item(self, host, path, descr, func, cost, *args, **kwargs):
+        return PlanItem(self, host, path, descr, func=func,
+                        args=args, kwargs=kwargs, cost=cost)
+
     def emit(self, path, format, ok, out, check=True):
         if check:
             if not self.collect_settings.allowed(path):
                 return
         self.res_q.put((ok, path, (format if ok else 'err'), out))
 
-    # should provides set of on_XXX methods
-    # where XXX - node role role
+    # should provides set of plan_XXX methods, where XXX - node role,
+    # which yields PlanItem's for node. Without plan_XXX method
+    # collect_XXX is scheduled as a single task
+    # def plan_XXX(self, path, node, **params):
+    #    pass
     # def collect_XXX(self, path, node, **params):
     #    pass
 
@@ -151,9 +362,64 @@ class CephDataCollector(Collector):
         self.osd_devs = {}
         self.osd_devs_lock = threading.Lock()
 
-    def collect_master(self, path=None, node=None):
+        # host => count of osd's, which are not collected yet
+        self.osds_left = {}
+        self.on_host_osds_ready = None
+
+    def set_host_osds_ready_callback(self, osds_per_host, callback):
+        # callback(host, osd_devs) is called from worker thread, as soon
+        # as all osd's for this host are collected
+        with self.osd_devs_lock:
+            self.osds_left = dict(osds_per_host)
+        self.on_host_osds_ready = callback
+
+    def osd_done(self, host):
+        with self.osd_devs_lock:
+            if host not in self.osds_left:
+                return
+
+            self.osds_left[host] -= 1
+            if self.osds_left[host] != 0:
+                return
+
+            osd_devs = []
+            for osd_host, data_dev, j_dev in self.osd_devs.values():
+                if osd_host == host:
+                    osd_devs.extend((data_dev, j_dev))
+
+        if self.on_host_osds_ready is not None and len(osd_devs) != 0:
+            self.on_host_osds_ready(host, osd_devs)
+
+    master_cmds = ['status', 'osd tree', 'df', 'auth list', 'osd dump',
+                   'health', 'mon_status', 'osd lspools', 'osd perf']
+
+    def plan_master(self, path, node, mon_hosts=()):
         path = path + "/master/"
 
+        yield self.task_item(None, path + "collected_at", "date",
+                             self.collect_time, (0.0, 100), path)
+
+        for cmd in self.master_cmds:
+            yield self.cmd_item(None, path + cmd.replace(" ", "_"), self.ceph_cmd + cmd, 'json')
+
+        yield self.cmd_item(None, path + "rados_df",
+                            "rados df -c {0.conf} -k {0.key} --format json".format(self.opts),
+                            'json')
+        yield self.cmd_item(None, path + "health_detail", self.ceph_cmd + 'health detail', 'json')
+
+        yield self.task_item(None, path + "pg_dump", self.ceph_cmd + "pg dump",
+                             self.collect_pg_dump, estimate_cost("pg dump"), path)
+        yield self.task_item(None, path + "crushmap", self.ceph_cmd + "osd getcrushmap",
+                             self.collect_crushmap, DEFAULT_CMD_COST, path)
+
+        if len(mon_hosts) != 0:
+            yield self.task_item(None, path + "ceph_log", "tail -n {0} cluster logs".format(
+                                     self.opts.ceph_log_max_lines),
+                                 self.collect_cluster_logs,
+                                 (1.0, 2 * estimate_cost("tail -n")[1]),
+                                 "", None, mon_hosts)
+
+    def collect_time(self, path):
         curr_data = "{0}\n{1}\n{2}".format(
             datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
@@ -161,37 +427,20 @@ class CephDataCollector(Collector):
 
         self.emit(path + "collected_at", 'txt', True, curr_data)
 
+    def collect_pg_dump(self, path):
         ok, status = check_output(self.ceph_cmd + "status")
-        self.emit(path + "status", 'json', ok, status)
         assert ok
 
-        cmds = ['osd tree', 'df', 'auth list', 'osd dump',
-                'health', 'mon_status', 'osd lspools',
-                'osd perf']
-
-        if json.loads(status)['pgmap']['num_pgs'] > self.opts.max_pg_dump_count:
+        num_pgs = json.loads(status)['pgmap']['num_pgs']
+        if num_pgs > self.opts.max_pg_dump_count:
             logger.warning(
                 ("pg dump skipped, as num_pg ({0}) > max_pg_dump_count ({1})." +
                  " Use --max-pg-dump-count NUM option to change the limit").format(
-                    json.loads(status)['pgmap']['num_pgs'],
-                    self.opts.max_pg_dump_count
-                 ))
-        else:
-            cmds.append('pg dump')
-
-        for cmd in cmds:
-            self.run2emit(path + cmd.replace(" ", "_"), 'json',
-                          self.ceph_cmd + cmd)
-
-        self.run2emit(path + "rados_df", 'json',
-                      "rados df -c {0.conf} -k {0.key} --format json".format(self.opts))
-
-        ok, out = check_output(self.ceph_cmd + 'health detail')
-        if not ok:
-            self.emit(path + 'health_detail', 'err', ok, out)
+                    num_pgs, self.opts.max_pg_dump_count))
         else:
-            self.emit(path + 'health_detail', 'json', ok, out)
+            self.run2emit(path + "pg_dump", 'json', self.ceph_cmd + 'pg dump')
 
+    def collect_crushmap(self, path):
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
             out_file = os.tempnam()
@@ -219,8 +468,10 @@ class CephDataCollector(Collector):
         assert ok
         is_ssd = is_ssd_str.strip() == '0'
 
-        self.ssh2emit(host, path + '/hdparm', 'txt', "sudo hdparm -I " + root_dev)
-        self.ssh2emit(host, path + '/smartctl', 'txt', "sudo smartctl -a " + root_dev)
+        self.cached_ssh2emit(host, path + '/hdparm', 'txt', "sudo hdparm -I " + root_dev,
+                             "hdparm " + root_dev)
+        self.cached_ssh2emit(host, path + '/smartctl', 'txt', "sudo smartctl -a " + root_dev,
+                             "smartctl " + root_dev)
         self.emit(path + '/stats', 'json', True,
                   json.dumps({'dev': dev,
                               'root_dev': root_dev,
@@ -230,30 +481,40 @@ class CephDataCollector(Collector):
         return root_dev
 
     def collect_osd(self, path, host, osd_id):
-        path = "{0}/osd/{1}/".format(path, osd_id)
-        ok, out = check_output_ssh(host, self.opts, "ps aux | grep ceph-osd")
+        try:
+            self.collect_osd_info(path, host, osd_id)
+        finally:
+            self.osd_done(host)
 
-        for line in out.split("/n"):
-            if '-i ' + str(osd_id) in line and 'ceph-osd' in line:
-                osd_running = True
-                break
-        else:
-            osd_running = False
+    def plan_osd(self, path, host, osd_id):
+        osd_path = "{0}/osd/{1}/".format(path, osd_id)
 
-        self.emit(path + "osd_daemons", 'txt', ok, out)
-        self.ssh2emit(host, path + "log", 'txt',
-                      "tail -n {0} /var/log/ceph/ceph-osd.{1}.log".format(
-                        self.opts.ceph_log_max_lines,
-                        osd_id
-                      ))
+        # same for all osd on the host, would be executed once
+        yield self.cmd_item(host, osd_path + "osd_daemons", "ps aux | grep ceph-osd")
+        yield self.cmd_item(host, osd_path + "log",
+                            "tail -n {0} /var/log/ceph/ceph-osd.{1}.log".format(
+                                self.opts.ceph_log_max_lines,
+                                osd_id
+                            ))
 
-        if osd_running:
+        # config, data and journal devices info
+        yield self.task_item(host, osd_path, "osd.{0} config and devices".format(osd_id),
+                             self.collect_osd, (8.0, 100 * 1024), path, host, osd_id)
+
+    def collect_osd_info(self, path, host, osd_id):
+        path = "{0}/osd/{1}/".format(path, osd_id)
+
+        # admin socket answers only for running osd
+        osd_running = False
+        if self.collect_settings.allowed(path + "config"):
             osd_cfg_cmd = "sudo ceph -f json --admin-daemon /var/run/ceph/ceph-osd.{0}.asok config show"
-            ok, data = check_output_ssh(host, self.opts, osd_cfg_cmd.format(osd_id))
+            ok, data = check_output_ssh(host, self.opts, osd_cfg_cmd.format(osd_id), strict=True)
 
-            self.emit(path + "config", 'json', ok, data)
-            assert ok
+            if ok:
+                osd_running = True
+                self.emit(path + "config", 'json', ok, data, check=False)
 
+        if osd_running:
             osd_cfg = json.loads(data)
 
             data_dev = osd_cfg.get('osd_data')
@@ -270,7 +531,7 @@ class CephDataCollector(Collector):
             jdev = None
 
         if not osd_running:
-            logger.warning("osd-{0} in node {1} is down.".format(osd_id, host) +
+            logger.warning("osd-{0} in node {1} is down or config disabled.".format(osd_id, host) +
                            " No config available, will use default data and journal path")
 
         if data_dev is None:
@@ -287,24 +548,55 @@ class CephDataCollector(Collector):
         with self.osd_devs_lock:
             self.osd_devs[osd_id] = (host, data_root_dev, jroot_dev)
 
-    def collect_monitor(self, path, host, name):
+    def plan_monitor(self, path, host, name):
         path = "{0}/mon/{1}/".format(path, host)
-        self.ssh2emit(host, path + "mon_daemons", 'txt', "ps aux | grep ceph-mon")
-        self.ssh2emit(host, path + "mon_log", 'txt',
-                      "tail -n {0} /var/log/ceph/ceph-mon.{1}.log".format(
-                        self.opts.ceph_log_max_lines,
-                        name
-                      ))
-        self.ssh2emit(host, path + "ceph_log", 'txt',
-                      "tail -n {0} /var/log/ceph/ceph.log".format(
-                        self.opts.ceph_log_max_lines,
-                        name
-                      ))
-        self.ssh2emit(host, path + "ceph_audit", 'txt',
-                      "tail -n {0} /var/log/ceph/ceph.audit.log".format(
-                        self.opts.ceph_log_max_lines,
-                        name
-                      ))
+        yield self.cmd_item(host, path + "mon_daemons", "ps aux | grep ceph-mon")
+        yield self.cmd_item(host, path + "mon_log",
+                            "tail -n {0} /var/log/ceph/ceph-mon.{1}.log".format(
+                                self.opts.ceph_log_max_lines,
+                                name
+                            ))
+
+    cluster_logs = [
+        ("ceph_log", "/var/log/ceph/ceph.log"),
+        ("ceph_audit", "/var/log/ceph/ceph.audit.log")
+    ]
+
+    def collect_cluster_logs(self, path, host, mon_hosts):
+        # ceph.log and ceph.audit.log are the same cluster log, replicated
+        # to all monitors, so get them from first healthy one only
+        path = path + "/master/"
+        logs = [(path + name, fname)
+                for name, fname in self.cluster_logs
+                if self.collect_settings.allowed(path + name)]
+
+        if len(logs) == 0:
+            return
+
+        ok, mon_status = check_output(self.ceph_cmd + "mon_status", strict=True)
+        if ok:
+            mon_status = json.loads(mon_status)
+            quorum = set(mon['name'] for mon in mon_status['monmap']['mons']
+                         if mon['rank'] in mon_status.get('quorum', []))
+            # monitors in quorum go first, keeping order stable
+            mon_hosts = sorted(mon_hosts, key=lambda host: host not in quorum)
+
+        for mon_host in mon_hosts:
+            outs = []
+            for log_path, fname in logs:
+                cmd = "tail -n {0} {1}".format(self.opts.ceph_log_max_lines, fname)
+                ok, out = check_output_ssh(mon_host, self.opts, cmd, strict=True)
+                if not ok:
+                    logger.warning("Can't get %s from monitor %s, will try next one", fname, mon_host)
+                    break
+                outs.append((log_path, out))
+            else:
+                for log_path, out in outs:
+                    self.emit(log_path, 'txt', True, out, check=False)
+                self.emit(path + "cluster_logs_host", 'txt', True, mon_host, check=False)
+                return
+
+        logger.error("Can't get cluster logs from any monitor")
 
 
 class NodeCollector(Collector):
@@ -330,11 +622,19 @@ class NodeCollector(Collector):
         ("netstat",   "txt", "netstat -nap")
     ]
 
-    def collect_node(self, path, host):
+    # slow and static outputs, which are taken from hw info cache, if possible
+    hw_inventory_commands = set(["lshw", "dmidecode"])
+
+    def plan_node(self, path, host):
         path = 'hosts/' + host + '/'
         for path_off, frmt, cmd in self.node_commands:
-            self.ssh2emit(host, path + path_off, frmt, cmd)
-        self.collect_interfaces_info(path, host)
+            if path_off in self.hw_inventory_commands:
+                yield self.cmd_item(host, path + path_off, cmd, frmt, hw_cache_item=path_off)
+            else:
+                yield self.cmd_item(host, path + path_off, cmd, frmt)
+
+        yield self.task_item(host, path + 'interfaces', "ethtool/iwconfig for all interfaces",
+                             self.collect_interfaces_info, (2.0, 2 * 1024), path, host)
 
     def collect_interfaces_info(self, path, host):
         interfaces = {}
@@ -386,6 +686,11 @@ class NodeResourseUsageCollector(Collector):
     name = 'resource'
     run_alone = True
 
+    def plan_node(self, path, host):
+        yield self.task_item(host, '{0}/rusage/{1}/'.format(path, host),
+                             "cat /proc/diskstats /proc/net/dev",
+                             self.collect_node, (0.6, 8 * 1024), path, host)
+
     def collect_node(self, path, host):
         cpath = '{0}/rusage/{1}/{2}-disk'.format(path, host, int(time.time()))
         self.ssh2emit(host, cpath, "txt", "cat /proc/diskstats")
@@ -438,6 +743,21 @@ class CephPerformanceCollector(Collector):
         self.net_file = "/tmp/net_{0}.txt".format(self.run_uuid)
         self.remote_file = "/tmp/{0}.sh".format(self.run_uuid)
 
+        # host => monitoring start time
+        self.started_at = {}
+        self.started_lock = threading.Lock()
+
+    def start_host_monitoring(self, host, osd_devs):
+        try:
+            self.start_performance_monitoring("", host, osd_devs)
+        except Exception:
+            logger.exception("Failed to start performance monitoring on node %s", host)
+            return
+
+        logger.debug("Performance monitoring started on node %s", host)
+        with self.started_lock:
+            self.started_at[host] = time.time()
+
     def start_performance_monitoring(self, path, host, osd_devs):
         local_file = "/tmp/{0}_{1}.sh".format(host, self.run_uuid)
 
@@ -518,7 +838,14 @@ class CephDiscovery(object):
                     yield 'osd', str(node['name']), {'osd_id': osd_id}
 
 
+# smaller outputs are cheaper to store, than to make a reference file for
+DEDUP_MIN_SIZE = 512
+
+
 def save_results_th_func(opts, res_q, out_folder):
+    # payload sha1 => file name of first stored copy
+    stored_blobs = {}
+
     try:
         while True:
             val = res_q.get()
@@ -528,7 +855,7 @@ def save_results_th_func(opts, res_q, out_folder):
             ok, path, frmt, out = val
 
             while '//' in path:
-                path.replace('//', '/')
+                path = path.replace('//', '/')
 
             while path.startswith('/'):
                 path = path[1:]
@@ -542,15 +869,24 @@ def save_results_th_func(opts, res_q, out_folder):
             if not os.path.exists(dr):
                 os.makedirs(dr)
 
+            if frmt == 'json' and not opts.no_pretty_json:
+                try:
+                    out = json.dumps(json.loads(out), indent=4, sort_keys=True)
+                except:
+                    pass
+
+            if not opts.no_dedup and len(out) >= DEDUP_MIN_SIZE:
+                blob_hash = hashlib.sha1(out).hexdigest()
+                if blob_hash in stored_blobs:
+                    # same data already stored - put reference to it instead
+                    ref_fname = os.path.join(out_folder, path + '.ref')
+                    target = os.path.relpath(stored_blobs[blob_hash], dr)
+                    open(ref_fname, "w").write(json.dumps({'ext': frmt, 'target': target}))
+                    continue
+                stored_blobs[blob_hash] = fname
+
             if frmt == 'bin':
                 open(fname, "wb").write(out)
-            elif frmt == 'json':
-                if not opts.no_pretty_json:
-                    try:
-                        out = json.dumps(json.loads(out), indent=4, sort_keys=True)
-                    except:
-                        pass
-                open(fname, "w").write(out)
             else:
                 open(fname, "w").write(out)
     except:
@@ -573,29 +909,121 @@ def discover_nodes(opts):
     return nodes
 
 
-def run_all(opts, run_q):
+# roles, which collection should start first. osd goes early, as
+# performance monitoring on host starts after all it osd's are collected
+ROLES_ORDER = ['master', 'osd', 'monitor', 'node']
+
+
+def compile_plan(nodes, collectors, collect_settings):
+    """
+    Expand discovered nodes into explicit list of PlanItem's. Disabled
+    paths are removed and same commands for the same host are merged,
+    before anything is executed
+    """
+    plan = []
+    items_by_key = {}
+    roles = sorted(nodes, key=lambda role: (role not in ROLES_ORDER,
+                                            ROLES_ORDER.index(role) if role in ROLES_ORDER else 0,
+                                            role))
+
+    for role in roles:
+        for collector in collectors:
+            if hasattr(collector, 'plan_' + role):
+                plan_func = getattr(collector, 'plan_' + role)
+            elif hasattr(collector, 'collect_' + role):
+                coll_func = getattr(collector, 'collect_' + role)
+
+                def plan_func(path, node, **kwargs):
+                    yield collector.task_item(node, "{0}/{1}/".format(role, node), coll_func.__name__,
+                                              coll_func, DEFAULT_CMD_COST, path, node, **kwargs)
+            else:
+                continue
+
+            for node, kwargs_list in sorted(nodes[role].items()):
+                for kwargs in kwargs_list:
+                    for item in plan_func("", node, **kwargs):
+                        item.paths = filter(collect_settings.allowed, item.paths)
+                        if len(item.paths) == 0:
+                            logger.debug("Skip disabled %r on node %s", item.cmd, item.host)
+                            continue
+
+                        key = item.key()
+                        if key in items_by_key:
+                            prev_item = items_by_key[key]
+                            prev_item.paths.extend(path for path in item.paths
+                                                   if path not in prev_item.paths)
+                        else:
+                            items_by_key[key] = item
+                            plan.append(item)
+    return plan
+
+
+def run_plan(opts, plan):
+    run_q = Queue.Queue()
+    map(run_q.put, plan)
+
     def pool_thread():
-        val = run_q.get()
-        while val is not None:
+        while True:
             try:
-                func, path, node, kwargs = val
-                func(path, node, **kwargs)
+                item = run_q.get(False)
+            except Queue.Empty:
+                return
+
+            try:
+                item.run()
             except:
                 logger.exception("In worker thread")
-            val = run_q.get()
 
     running_threads = []
-    for i in range(opts.pool_size):
+    for i in range(min(opts.pool_size, len(plan))):
         th = threading.Thread(target=pool_thread)
         th.daemon = True
         th.start()
         running_threads.append(th)
-        run_q.put(None)
 
-    while True:
-        time.sleep(0.01)
-        if all(not th.is_alive() for th in running_threads):
-            break
+    for th in running_threads:
+        th.join()
+
+
+def format_size(size):
+    for name, scale in (('GiB', 1024 ** 3), ('MiB', 1024 ** 2), ('KiB', 1024)):
+        if size >= scale:
+            return "{0:.1f} {1}".format(float(size) / scale, name)
+    return "{0} B".format(size)
+
+
+def print_plan(opts, stages, window):
+    # stages - [(title, plan, times to run)]
+    total_time = 0
+    total_size = 0
+    max_item_time = 0
+
+    for title, plan, repeat in stages:
+        print "{0}: {1} items{2}".format(title, len(plan), "" if repeat == 1 else " x " + str(repeat))
+        for item in plan:
+            est_time, est_size = item.cost
+            total_time += est_time * repeat
+            total_size += est_size * len(item.paths) * repeat
+            max_item_time = max(max_item_time, est_time)
+
+            path = item.paths[0]
+            if len(item.paths) > 1:
+                path += " (+{0})".format(len(item.paths) - 1)
+
+            cmd = item.cmd
+            if item.hw_cache_item is not None:
+                cmd += " [cached]"
+
+            print "    {0:<16} {1:<40} {2:>6.1f}s {3:>10}  {4}".format(
+                item.host if item.host is not None else "<local>",
+                path, est_time, format_size(est_size), cmd)
+        print
+
+    collect_time = max(total_time / opts.pool_size, max_item_time)
+    print "Total estimated command time : {0:.1f}s".format(total_time)
+    print "Estimated wall time          : {0:.1f}s".format(max(collect_time, window))
+    print "Estimated transfer size      : {0}".format(format_size(total_size))
+    print "Hw info cache items may take much less"
 
 
 def setup_loggers(default_level=logging.INFO, log_fname=None):
@@ -678,6 +1106,25 @@ def parse_args(argv):
                    action="store_true",
                    help="Don't prettify json data")
 
+    p.add_argument("--dry-run", default=False,
+                   action="store_true",
+                   help="Only print collection plan with estimated time and size")
+
+    p.add_argument("--no-dedup", default=False,
+                   action="store_true",
+                   help="Store identical outputs as separated files")
+
+    p.add_argument("--hw-cache-dir", default="/var/tmp/ceph_monitoring_hw_cache",
+                   help="Folder to cache lshw/dmidecode/hdparm/smartctl outputs")
+
+    p.add_argument("--hw-cache-max-age", default=7 * 24 * 3600,
+                   type=int, metavar="SEC",
+                   help="Recollect cached hw info, if it older than SEC seconds")
+
+    p.add_argument("--no-hw-cache", default=False,
+                   action="store_true",
+                   help="Don't use hw info cache")
+
     return p.parse_args(argv[1:])
 
 
@@ -741,33 +1188,41 @@ def main(argv):
     # TODO: Logs from down OSD
     opts = parse_args(argv)
     res_q = Queue.Queue()
-    run_q = Queue.Queue()
 
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        out_folder = os.tempnam()
+    if opts.dry_run:
+        out_folder = None
+        setup_loggers(getattr(logging, opts.log_level))
+    else:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            out_folder = os.tempnam()
 
-    os.makedirs(out_folder)
+        os.makedirs(out_folder)
 
-    setup_loggers(getattr(logging, opts.log_level),
-                  os.path.join(out_folder, "log.txt"))
+        setup_loggers(getattr(logging, opts.log_level),
+                      os.path.join(out_folder, "log.txt"))
     global logger_ready
     logger_ready = True
 
     collector_settings = CollectSettings()
     map(collector_settings.disable, opts.disable)
 
+    if opts.no_hw_cache:
+        hw_cache = None
+    else:
+        hw_cache = HWInfoCache(opts, opts.hw_cache_dir, opts.hw_cache_max_age)
+
     allowed_collectors = opts.collectors.split(',')
     collectors = []
 
     if CephDataCollector.name in allowed_collectors:
-        ceph_collector = CephDataCollector(opts, collector_settings, res_q)
+        ceph_collector = CephDataCollector(opts, collector_settings, res_q, hw_cache)
         collectors.append(ceph_collector)
     else:
         ceph_collector = None
 
     if NodeCollector.name in allowed_collectors:
-        node_collector = NodeCollector(opts, collector_settings, res_q)
+        node_collector = NodeCollector(opts, collector_settings, res_q, hw_cache)
         collectors.append(node_collector)
     else:
         node_collector = None
@@ -818,19 +1273,48 @@ def main(argv):
                     new_nodes[role][node] = args
 
     nodes = new_nodes
+    nodes['master'][None] = [{'mon_hosts': sorted(nodes['monitor'])}]
+
+    plan = compile_plan(nodes, collectors, collector_settings)
 
-    # collect data at the beginning
     if node_resource_collector is not None:
-        for node, _ in nodes['node'].items():
-            run_q.put((node_resource_collector.collect_node, "", node, {}))
+        rusage_plan = compile_plan(nodes, [node_resource_collector], collector_settings)
+    else:
+        rusage_plan = []
 
-    for role, nodes_with_args in nodes.items():
-        for collector in collectors:
-            if hasattr(collector, 'collect_' + role):
-                coll_func = getattr(collector, 'collect_' + role)
-                for node, kwargs_list in nodes_with_args.items():
-                    for kwargs in kwargs_list:
-                        run_q.put((coll_func, "", node, kwargs))
+    if ceph_performance_collector is not None:
+        perf_hosts = sorted(nodes['osd'])
+    else:
+        perf_hosts = []
+
+    logger.info("Collection plan: %s items", len(plan) + len(rusage_plan) * 2)
+
+    if opts.dry_run:
+        window = 0
+        if len(rusage_plan) != 0:
+            window = opts.usage_collect_interval
+        if len(perf_hosts) != 0:
+            window = max(window, opts.performance_collect_seconds)
+
+        stages = [("Collection", plan, 1), ("Resource usage", rusage_plan, 2)]
+        if len(perf_hosts) != 0:
+            stages.append(("Performance monitoring", [
+                ceph_performance_collector.task_item(host, "perf_monitoring/{0}/".format(host),
+                                                     "monitoring script + cat results",
+                                                     None, (2.0, 100 * opts.performance_collect_seconds))
+                for host in perf_hosts
+            ], 1))
+
+        print_plan(opts, stages, window)
+        return 0
+
+    # start performance monitoring on each host as soon, as it osd devices
+    # are known, in parallel with rest of data collection
+    if ceph_performance_collector is not None:
+        osds_per_host = collections.Counter(item.host for item in plan
+                                            if item.func == ceph_collector.collect_osd)
+        ceph_collector.set_host_osds_ready_callback(
+            osds_per_host, ceph_performance_collector.start_host_monitoring)
 
     save_results_thread = threading.Thread(target=save_results_th_func,
                                            args=(opts, res_q, out_folder))
@@ -839,48 +1323,51 @@ def main(argv):
 
     t1 = time.time()
     try:
-        run_all(opts, run_q)
-
-        # collect data at the end
-        if node_resource_collector is not None:
-            dt = opts.usage_collect_interval - (time.time() - t1)
-            if dt > 0:
-                logger.info("Will wait for {0} seconds for usage collection".format(int(dt)))
-                for i in range(int(dt / 0.1)):
-                    time.sleep(0.1)
-            logger.info("Start final usage collection")
-            for node, _ in nodes['node'].items():
-                run_q.put((node_resource_collector.collect_node, "", node, {}))
-            run_all(opts, run_q)
+        # collect usage at the beginning together with all other data
+        run_plan(opts, rusage_plan + plan)
+
+        # final usage snapshot and performance results are collected together,
+        # when both usage interval and last monitoring window are over
+        wait_till = t1
+
+        if len(rusage_plan) != 0:
+            wait_till = t1 + opts.usage_collect_interval
 
         if ceph_performance_collector is not None:
-            logger.info("Start performace monitoring.")
-            with ceph_collector.osd_devs_lock:
-                osd_devs = ceph_collector.osd_devs.copy()
-
-            per_node = collections.defaultdict(lambda: [])
-            for node, data_dev, j_dev in osd_devs.values():
-                per_node[node].extend((data_dev, j_dev))
-
-            # start monitoring
-            for node, data in per_node.items():
-                run_q.put((ceph_performance_collector.start_performance_monitoring,
-                          "", node, {'osd_devs': data}))
-            run_all(opts, run_q)
-
-            dt = opts.performance_collect_seconds
-            logger.info("Will wait for {0} seconds for performance collection".format(int(dt)))
+            with ceph_performance_collector.started_lock:
+                perf_started_at = ceph_performance_collector.started_at.copy()
+
+            if len(perf_started_at) != 0:
+                wait_till = max(wait_till,
+                                max(perf_started_at.values()) + opts.performance_collect_seconds)
+        else:
+            perf_started_at = {}
+
+        dt = wait_till - time.time()
+        if dt > 0:
+            logger.info("Will wait for {0} seconds for usage and performance collection".format(int(dt)))
             for i in range(int(dt / 0.1)):
                 time.sleep(0.1)
 
-            # collect results
-            for node, data in per_node.items():
-                run_q.put((ceph_performance_collector.collect_performance_data,
-                          "", node, {}))
-            run_all(opts, run_q)
+        final_plan = list(rusage_plan)
+        if len(rusage_plan) != 0:
+            logger.info("Start final usage collection")
+
+        if len(perf_started_at) != 0:
+            logger.info("Collect performance monitoring results")
+            for node in sorted(perf_started_at):
+                final_plan.append(ceph_performance_collector.task_item(
+                    node, "perf_monitoring/{0}/".format(node), "cat monitoring results",
+                    ceph_performance_collector.collect_performance_data, DEFAULT_CMD_COST,
+                    "", node))
+
+        run_plan(opts, final_plan)
     except:
         logger.exception("When collecting data:")
     finally:
+        if hw_cache is not None:
+            for host, items in hw_cache.freshness.items():
+                res_q.put((True, 'hosts/{0}/hw_cache'.format(host), 'json', json.dumps(items)))
         res_q.put(None)
         # wait till all data collected
         save_results_thread.join()
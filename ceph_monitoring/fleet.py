@@ -0,0 +1,172 @@
+import sys
+import time
+import os.path
+import argparse
+import traceback
+import multiprocessing
+
+import html2
+from hw_info import b2ssize
+from storage import open_storage
+from visualize_cluster import Report, make_report, html_ok, html_fail, H
+import visualize_cluster
+
+
+def report_name(path):
+    name = os.path.basename(path.rstrip('/'))
+    for ext in ('.tar.gz', '.tgz', '.tar'):
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return name
+
+
+def cluster_summary(cluster):
+    # uses only master/ data, so works with --summary-only reports
+    worst_lat, worst_osd = None, None
+    for osd_id in cluster.osd_ids:
+        osd_perf = cluster.osd_perf_by_id.get(osd_id)
+        if osd_perf is None:
+            continue
+        lat = osd_perf["commit_latency_ms"]
+        if worst_lat is None or lat > worst_lat:
+            worst_lat, worst_osd = lat, osd_id
+
+    return {'status': cluster.overall_status,
+            'bytes_total': cluster.bytes_total,
+            'bytes_used': cluster.bytes_used,
+            'osd_count': len(cluster.osd_ids),
+            'worst_lat': worst_lat,
+            'worst_osd': worst_osd}
+
+
+def process_archive(params):
+    # runs in worker process, must never raise - one broken archive
+    # should not stop the whole fleet
+    path, name, out_folder, report_args = params
+    t0 = time.time()
+    res = {'path': path, 'name': name, 'error': None}
+    try:
+        opts = visualize_cluster.parse_args(["visualize"] + report_args +
+                                            ["-w", "-n", name, "-o", out_folder, path])
+        if not os.path.exists(out_folder):
+            os.makedirs(out_folder)
+        cluster = make_report(opts, open_storage(path, opts.mmap_threshold))
+        res.update(cluster_summary(cluster))
+    except Exception:
+        res['error'] = traceback.format_exc()
+    res['time'] = time.time() - t0
+    return res
+
+
+def show_fleet_index(results, out_folder):
+    report = Report("fleet", "index.html")
+    report.style.append('body {font: 10pt sans;}')
+    report.style_links.append("https://maxcdn.bootstrapcdn.com/bootstrap/3.3.4/css/bootstrap.min.css")
+    report.script_links.append("http://www.kryogenix.org/code/browser/sorttable/sorttable.js")
+
+    table = html2.HTMLTable(headers=["Cluster", "Status", "OSD count", "Used", "Total",
+                                     "Used %", "Worst OSD<br>commit latency", "Processing<br>time"])
+
+    for res in sorted(results, key=lambda x: x['name']):
+        if res['error'] is not None:
+            table.add_cell(res['name'])
+            table.add_cell(html_fail("report failed"))
+            for _ in range(6):
+                table.add_cell("-")
+            table.next_row()
+            continue
+
+        table.add_cell(H.a(res['name'], href=res['name'] + "/index.html"))
+
+        if res['status'] == "HEALTH_OK":
+            table.add_cell(html_ok(res['status']))
+        else:
+            table.add_cell(html_fail(res['status']))
+
+        table.add_cell(str(res['osd_count']))
+        table.add_cell(b2ssize(res['bytes_used'], False), sorttable_customkey=str(res['bytes_used']))
+        table.add_cell(b2ssize(res['bytes_total'], False), sorttable_customkey=str(res['bytes_total']))
+
+        if res['bytes_total']:
+            table.add_cell(str(res['bytes_used'] * 100 // res['bytes_total']))
+        else:
+            table.add_cell("-")
+
+        if res['worst_lat'] is None:
+            table.add_cell("-", sorttable_customkey='0')
+        else:
+            table.add_cell("{0} ms (osd.{1})".format(res['worst_lat'], res['worst_osd']),
+                           sorttable_customkey=str(res['worst_lat']))
+
+        table.add_cell("{0:.1f}s".format(res['time']))
+        table.next_row()
+
+    report.add_block(12, "Clusters:", table)
+    report.save_to(out_folder)
+    return os.path.join(out_folder, "index.html")
+
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description="Build reports for many collected archives in parallel")
+    p.add_argument("-o", "--out", required=True, help="Output folder, each report goes to own subfolder")
+    p.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                   help="Worker processes count (default - cpu count)")
+    p.add_argument("-t", "--timeout", type=int, default=3600, metavar="SECONDS",
+                   help="Report archive as failed, if its report isn't ready in SECONDS " +
+                        "(default 3600), e.g. when worker was killed")
+    p.add_argument("-r", "--report-opts", default="",
+                   help="Extra visualize_cluster options, like '-s -g'")
+    p.add_argument("data", nargs="+", help="Folders with data or .tar.gz archives")
+    return p.parse_args(argv[1:])
+
+
+def main(argv):
+    opts = parse_args(argv)
+
+    tasks = []
+    used_names = set()
+    for path in opts.data:
+        name = base_name = report_name(path)
+        idx = 1
+        while name in used_names:
+            idx += 1
+            name = "{0}_{1}".format(base_name, idx)
+        used_names.add(name)
+        tasks.append((path, name, os.path.join(opts.out, name), opts.report_opts.split()))
+
+    if not os.path.exists(opts.out):
+        os.makedirs(opts.out)
+
+    # worker, killed by OOM or crashed in C code, never returns result, so
+    # results are waited with timeout. Each archive is processed in fresh process
+    results = []
+    lost = False
+    pool = multiprocessing.Pool(processes=max(1, opts.jobs), maxtasksperchild=1)
+    try:
+        pending = [(task, pool.apply_async(process_archive, (task,))) for task in tasks]
+        for (path, name, _, _), async_res in pending:
+            try:
+                res = async_res.get(opts.timeout)
+            except multiprocessing.TimeoutError:
+                lost = True
+                res = {'path': path, 'name': name, 'time': opts.timeout,
+                       'error': "No result in {0}s, worker was killed or hung".format(opts.timeout)}
+
+            results.append(res)
+            if res['error'] is None:
+                print "[{0}/{1}] {2} done in {3:.1f}s".format(len(results), len(tasks), res['path'], res['time'])
+            else:
+                print "[{0}/{1}] {2} FAILED:\n{3}".format(len(results), len(tasks), res['path'], res['error'])
+    finally:
+        if lost:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+    print "Fleet index stored in", show_fleet_index(results, opts.out)
+    return 0 if all(res['error'] is None for res in results) else 1
+
+
+if __name__ == "__main__":
+    exit(main(sys.argv))
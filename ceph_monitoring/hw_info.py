@@ -1,5 +1,12 @@
 import re
-import xml.etree.ElementTree as ET
+import copy
+import hashlib
+import StringIO
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 
 def get_data(rr, data):
@@ -150,130 +157,216 @@ class HWInfo(object):
         return str(self.hostname) + ":\n" + "\n".join("    " + i for i in res)
 
 
-def get_hw_info(lshw_out):
+class LshwNode(object):
+    """
+    Compact copy of lshw <node> element: first occurrence of every simple
+    child tag as (text, attrib) and settings from <configuration>'s.
+    Child nodes are kept only for memory nodes - RAM size may be in slots
+    """
+    __slots__ = ('order', 'last', 'depth', 'in_node', 'id', 'cls', 'props', 'settings', 'children')
+
+    def __init__(self, order, depth, in_node, elem):
+        # order - position in document, last - order of last node in subtree
+        self.order = self.last = order
+        self.depth = depth
+        # parent element is <node> too
+        self.in_node = in_node
+        self.id = elem.attrib.get('id')
+        self.cls = elem.attrib.get('class')
+        self.props = {}
+        self.settings = None
+        self.children = []
+
+    def text(self, tag):
+        # AttributeError for absent tag, same as for ElementTree find(tag).text
+        try:
+            return self.props[tag][0]
+        except KeyError:
+            raise AttributeError(tag)
+
+    def setting(self, name):
+        if self.settings is None:
+            return None
+        return self.settings.get(name)
+
+    def size(self):
+        text, attrib = self.props['size']
+        assert attrib.get('units') == 'bytes'
+        return int(text)
+
+    def contains(self, node):
+        return self.order < node.order <= self.last
+
+
+def iter_lshw_nodes(lshw_out):
+    """
+    Single pass over lshw xml, yields all <node>'s in post-order. Parsed
+    elements are cleared, so only compact LshwNode copies stay in memory
+    """
+    # open elements, LshwNode for <node> and None for others
+    path = []
+    order = 0
+    for event, elem in ET.iterparse(StringIO.StringIO(lshw_out), events=('start', 'end')):
+        if event == 'start':
+            node = None
+            if elem.tag == 'node':
+                in_node = bool(path) and path[-1] is not None
+                node = LshwNode(order, len(path), in_node, elem)
+                order += 1
+                if in_node:
+                    path[-1].children.append(node)
+            path.append(node)
+            continue
+
+        node = path.pop()
+        if node is not None:
+            node.last = order - 1
+            for child in node.children:
+                if child.cls != 'memory':
+                    child.children = []
+            elem.clear()
+            yield node
+        elif path and path[-1] is not None:
+            parent = path[-1]
+            if elem.tag == 'configuration':
+                if parent.settings is None:
+                    parent.settings = {}
+                for setting in elem:
+                    if setting.tag == 'setting':
+                        parent.settings.setdefault(setting.attrib.get('id'), setting.attrib.get('value'))
+            elif elem.tag not in parent.props:
+                parent.props[elem.tag] = (elem.text, dict(elem.attrib))
+            elem.clear()
+
+
+def parse_lshw(lshw_out):
     res = HWInfo()
-
     res.raw = lshw_out
-    lshw_et = ET.fromstring(lshw_out)
 
-    try:
-        res.hostname = lshw_et.find("node").attrib['id']
-    except:
-        pass
+    # root element has depth 0, as in ElementTree paths from it
+    top = core = None
+    items = []
+    for node in iter_lshw_nodes(lshw_out):
+        if node.depth == 1:
+            if top is None or node.order < top.order:
+                top = node
+        elif node.depth == 2 and node.in_node and node.id == 'core':
+            if core is None or node.order < core.order:
+                core = node
+        elif node.depth > 2 and node.cls in ('processor', 'memory', 'network', 'storage', 'disk'):
+            items.append(node)
+
+    if top is not None:
+        res.hostname = top.id
 
-    try:
-        res.sys_name = (lshw_et.find("node/vendor").text + " " +
-                        lshw_et.find("node/product").text)
-        res.sys_name = res.sys_name.replace("(To be filled by O.E.M.)", "")
-        res.sys_name = res.sys_name.replace("(To be Filled by O.E.M.)", "")
-    except:
-        pass
+        try:
+            res.sys_name = top.text('vendor') + " " + top.text('product')
+            res.sys_name = res.sys_name.replace("(To be filled by O.E.M.)", "")
+            res.sys_name = res.sys_name.replace("(To be Filled by O.E.M.)", "")
+        except:
+            pass
 
-    core = lshw_et.find("node/node[@id='core']")
     if core is None:
-        return
+        return None
 
     try:
-        res.mb = " ".join(core.find(node).text
-                          for node in ['vendor', 'product', 'version'])
+        res.mb = " ".join(core.text(node) for node in ['vendor', 'product', 'version'])
     except:
         pass
 
-    for cpu in core.findall("node[@class='processor']"):
-        try:
-            model = cpu.find('product').text
-            threads_node = cpu.find("configuration/setting[@id='threads']")
-            if threads_node is None:
-                threads = 1
-            else:
-                threads = int(threads_node.attrib['value'])
-            res.cores.append((model, threads))
-        except:
-            pass
+    items = sorted((node for node in items if core.contains(node)), key=lambda node: node.order)
+
+    for cpu in items:
+        if cpu.cls == 'processor' and cpu.depth == core.depth + 1:
+            try:
+                model = cpu.text('product')
+                threads = cpu.setting('threads')
+                res.cores.append((model, 1 if threads is None else int(threads)))
+            except:
+                pass
 
     res.ram_size = 0
-    for mem_node in core.findall(".//node[@class='memory']"):
-        descr = mem_node.find('description')
-        try:
-            if descr is not None and descr.text == 'System Memory':
-                mem_sz = mem_node.find('size')
-                if mem_sz is None:
-                    for slot_node in mem_node.find("node[@class='memory']"):
-                        slot_sz = slot_node.find('size')
-                        if slot_sz is not None:
-                            assert slot_sz.attrib['units'] == 'bytes'
-                            res.ram_size += int(slot_sz.text)
-                else:
-                    assert mem_sz.attrib['units'] == 'bytes'
-                    res.ram_size += int(mem_sz.text)
-        except:
-            pass
+    for mem_node in items:
+        if mem_node.cls != 'memory' or mem_node.props.get('description', (None,))[0] != 'System Memory':
+            continue
 
-    for net in core.findall(".//node[@class='network']"):
         try:
-            link = net.find("configuration/setting[@id='link']")
-            if link.attrib['value'] == 'yes':
-                name = net.find("logicalname").text
-                speed_node = net.find("configuration/setting[@id='speed']")
-
-                if speed_node is None:
-                    speed = None
-                else:
-                    speed = speed_node.attrib['value']
-
-                dup_node = net.find("configuration/setting[@id='duplex']")
-                if dup_node is None:
-                    dup = None
-                else:
-                    dup = dup_node.attrib['value']
-
-                res.net_info[name] = (speed, dup, [])
+            if 'size' in mem_node.props:
+                res.ram_size += mem_node.size()
+            else:
+                # same as in original tree-based parser - sizes are taken from first bank children
+                bank = [child for child in mem_node.children if child.cls == 'memory'][0]
+                for slot_node in bank.children:
+                    if 'size' in slot_node.props:
+                        res.ram_size += slot_node.size()
         except:
             pass
 
-    for controller in core.findall(".//node[@class='storage']"):
-        try:
-            description = getattr(controller.find("description"), 'text', "")
-            product = getattr(controller.find("product"), 'text', "")
-            vendor = getattr(controller.find("vendor"), 'text', "")
-            dev = getattr(controller.find("logicalname"), 'text', "")
+    for net in items:
+        if net.cls == 'network':
+            try:
+                if net.settings['link'] == 'yes':
+                    res.net_info[net.text("logicalname")] = (net.setting('speed'), net.setting('duplex'), [])
+            except:
+                pass
+
+    for controller in items:
+        if controller.cls == 'storage':
+            description, product, vendor, dev = [controller.props.get(tag, ("",))[0]
+                                                 for tag in ("description", "product", "vendor", "logicalname")]
             if dev != "":
                 res.storage_controllers.append(
-                    "{0}: {1} {2} {3}".format(dev, description,
-                                              vendor, product))
+                    "{0}: {1} {2} {3}".format(dev, description, vendor, product))
             else:
                 res.storage_controllers.append(
-                    "{0} {1} {2}".format(description,
-                                         vendor, product))
-        except:
-            pass
+                    "{0} {1} {2}".format(description, vendor, product))
+
+    for disk in items:
+        if disk.cls != 'disk':
+            continue
 
-    for disk in core.findall(".//node[@class='disk']"):
         try:
-            lname_node = disk.find('logicalname')
-            if lname_node is not None:
-                dev = lname_node.text.split('/')[-1]
+            if 'logicalname' in disk.props:
+                dev = disk.text('logicalname').split('/')[-1]
 
                 if dev == "" or dev[-1].isdigit():
                     continue
 
-                sz_node = disk.find('size')
-                assert sz_node.attrib['units'] == 'bytes'
-                sz = int(sz_node.text)
-                res.disks_info[dev] = ('', sz)
+                res.disks_info[dev] = ('', disk.size())
             else:
-                description = disk.find('description').text
-                product = disk.find('product').text
-                vendor = disk.find('vendor').text
-                version = disk.find('version').text
-                serial = disk.find('serial').text
-
                 full_descr = "{0} {1} {2} {3} {4}".format(
-                    description, product, vendor, version, serial)
-
-                businfo = disk.find('businfo').text
-                res.disks_raw_info[businfo] = full_descr
+                    *[disk.text(tag) for tag in ('description', 'product', 'vendor', 'version', 'serial')])
+                res.disks_raw_info[disk.text('businfo')] = full_descr
         except:
             pass
 
     return res
+
+
+# sha1 of lshw output => parsed HWInfo without raw xml, or None if lshw output has no core node
+hw_info_cache = {}
+HW_INFO_CACHE_SIZE = 1024
+
+
+def get_hw_info(lshw_out):
+    """
+    Parse lshw -xml output. Results are memoized by content hash, so hosts
+    with identical lshw output are parsed once. Each call returns own copy
+    """
+    key = hashlib.sha1(lshw_out).hexdigest()
+    if key in hw_info_cache:
+        info = hw_info_cache[key]
+    else:
+        if len(hw_info_cache) >= HW_INFO_CACHE_SIZE:
+            hw_info_cache.clear()
+        info = parse_lshw(lshw_out)
+        if info is not None:
+            info.raw = None
+        hw_info_cache[key] = info
+
+    if info is None:
+        return None
+
+    res = copy.deepcopy(info)
+    res.raw = lshw_out
+    return res
@@ -0,0 +1,340 @@
+import sys
+import json
+import zlib
+import sqlite3
+import os.path
+import argparse
+import calendar
+import datetime
+
+import numpy
+
+from cluster import CephCluster
+from storage import open_storage, JResultStorage, content_hash
+from visualize_cluster import Report, rickshaw_js_links, rickshaw_code, H, val_to_color
+
+
+# Append-only store of metrics from many collected snapshots.
+# Scalar metrics goes to 'samples', keyed by (entity, metric, ts), so range
+# queries for one entity are index scans. Per-second perf series are stored
+# in 'series' as zlib-compressed float32 arrays, one blob per snapshot.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    cluster TEXT NOT NULL,
+    ts REAL NOT NULL,
+    source TEXT NOT NULL,
+    hash TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS entities (
+    id INTEGER PRIMARY KEY,
+    cluster TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (cluster, kind, name)
+);
+
+CREATE TABLE IF NOT EXISTS metrics (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS samples (
+    entity_id INTEGER NOT NULL,
+    metric_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    snapshot_id INTEGER NOT NULL,
+    value REAL,
+    PRIMARY KEY (entity_id, metric_id, ts, snapshot_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS series (
+    entity_id INTEGER NOT NULL,
+    metric_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    snapshot_id INTEGER NOT NULL,
+    step REAL NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (entity_id, metric_id, ts, snapshot_id)
+) WITHOUT ROWID;
+"""
+
+CLUSTER_METRICS = ['num_pgs', 'bytes_used', 'bytes_total', 'bytes_avail',
+                   'data_bytes', 'write_bytes_sec', 'op_per_sec']
+DEV_METRICS = ['read_bytes_curr', 'write_bytes_curr', 'read_iops_curr', 'write_iops_curr',
+               'lat_curr', 'queue_depth_curr']
+POOL_METRICS = ['num_objects', 'size_bytes', 'read_bytes', 'write_bytes']
+
+
+def iter_metrics(cluster):
+    # (kind, name, metric, value)
+    for metric in CLUSTER_METRICS:
+        yield 'cluster', '', metric, getattr(cluster, metric, None)
+
+    for osd in cluster.osds:
+        name = "osd.{0}".format(osd.id)
+        yield 'osd', name, 'pg_count', osd.pg_count
+        if osd.osd_perf is not None:
+            for metric, value in osd.osd_perf.items():
+                yield 'osd', name, metric, value
+
+        if osd.data_stor_stats is not None:
+            yield 'osd', name, 'used', osd.data_stor_stats.get('used')
+            yield 'osd', name, 'avail', osd.data_stor_stats.get('avail')
+
+        for dev_stat in (osd.data_stor_stats, osd.j_stor_stats):
+            if dev_stat is not None:
+                dev_name = "{0}:{1}".format(osd.host, os.path.basename(dev_stat.root_dev))
+                for metric in DEV_METRICS:
+                    yield 'dev', dev_name, metric, dev_stat.get(metric)
+
+    for host in cluster.hosts.values():
+        for metric in ('mem_total', 'mem_free', 'swap_free', 'load_5m'):
+            yield 'host', host.name, metric, getattr(host, metric, None)
+
+        for net in (host.cluster_net, host.public_net):
+            if net is not None and net.perf_stats_curr is not None:
+                for metric, value in net.perf_stats_curr.items():
+                    yield 'net', "{0}:{1}".format(host.name, net.name), metric, value
+
+    for pool in cluster.pools.values():
+        for metric in POOL_METRICS:
+            yield 'pool', pool.name, metric, getattr(pool, metric, None)
+
+
+def iter_series(cluster):
+    # (kind, name, metric, start_ts, step, values)
+    for host in cluster.hosts.values():
+        perf_m = host.perf_monitoring
+        if not perf_m or 'io' not in perf_m:
+            continue
+
+        for dev, log in perf_m['io'].items():
+            if len(log) < 2:
+                continue
+
+            for metric, field in [('read_iops', 'reads_completed'), ('write_iops', 'writes_completed')]:
+                vals = numpy.diff(log[field])
+                yield 'dev', "{0}:{1}".format(host.name, dev), metric, log.start_timstamp, 1.0, vals
+
+
+def parse_time(val):
+    try:
+        return float(val)
+    except ValueError:
+        return calendar.timegm(datetime.datetime.strptime(val, "%Y-%m-%d").timetuple())
+
+
+class MetricsHistory(object):
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.ids_cache = {}
+
+    def _id(self, table, **key):
+        cache_key = (table,) + tuple(sorted(key.items()))
+        if cache_key not in self.ids_cache:
+            names = sorted(key)
+            where = " AND ".join(name + " = ?" for name in names)
+            params = [key[name] for name in names]
+            row = self.conn.execute("SELECT id FROM {0} WHERE {1}".format(table, where), params).fetchone()
+            if row is None:
+                cursor = self.conn.execute("INSERT INTO {0} ({1}) VALUES ({2})".format(
+                    table, ", ".join(names), ", ".join("?" * len(names))), params)
+                self.ids_cache[cache_key] = cursor.lastrowid
+            else:
+                self.ids_cache[cache_key] = row[0]
+        return self.ids_cache[cache_key]
+
+    def ingest(self, path, cluster_name=None):
+        # returns snapshot id, or None, if this data was already ingested
+        data_hash = content_hash(path)
+        if self.conn.execute("SELECT id FROM snapshots WHERE hash = ?", (data_hash,)).fetchone():
+            return None
+
+        storage = open_storage(path)
+        jstorage = JResultStorage(storage)
+        cluster = CephCluster(jstorage, storage)
+        cluster.load()
+
+        if cluster_name is None:
+            cluster_name = jstorage.master.status.get('fsid') or os.path.basename(path.rstrip('/'))
+
+        ts = cluster.report_collected_at_ts
+        try:
+            with self.conn:
+                snap_id = self.conn.execute(
+                    "INSERT INTO snapshots (cluster, ts, source, hash) VALUES (?, ?, ?, ?)",
+                    (cluster_name, ts, os.path.abspath(path), data_hash)).lastrowid
+
+                # shared devices (like journal SSD) are reported once per OSD
+                samples = {}
+                for kind, name, metric, value in iter_metrics(cluster):
+                    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+                        samples[(self._id('entities', cluster=cluster_name, kind=kind, name=name),
+                                 self._id('metrics', name=metric))] = value
+
+                self.conn.executemany("INSERT INTO samples VALUES (?, ?, ?, ?, ?)",
+                                      [(entity_id, metric_id, ts, snap_id, value)
+                                       for (entity_id, metric_id), value in samples.items()])
+
+                for kind, name, metric, start_ts, step, values in iter_series(cluster):
+                    blob = zlib.compress(numpy.asarray(values, dtype=numpy.float32).tostring())
+                    self.conn.execute("INSERT INTO series VALUES (?, ?, ?, ?, ?, ?)",
+                                      (self._id('entities', cluster=cluster_name, kind=kind, name=name),
+                                       self._id('metrics', name=metric), start_ts, snap_id, step,
+                                       sqlite3.Binary(blob)))
+        except:
+            # ids of rolled back rows may be reused
+            self.ids_cache = {}
+            raise
+
+        return snap_id
+
+    def _range(self, table, columns, kind, name, metric, ts_from=None, ts_to=None, cluster=None):
+        sql = ("SELECT e.cluster, {0} FROM {1} AS t " +
+               "JOIN entities AS e ON e.id = t.entity_id " +
+               "JOIN metrics AS m ON m.id = t.metric_id " +
+               "WHERE e.kind = ? AND e.name = ? AND m.name = ?").format(columns, table)
+        params = [kind, name, metric]
+
+        if cluster is not None:
+            sql += " AND e.cluster = ?"
+            params.append(cluster)
+        if ts_from is not None:
+            sql += " AND t.ts >= ?"
+            params.append(ts_from)
+        if ts_to is not None:
+            sql += " AND t.ts <= ?"
+            params.append(ts_to)
+
+        return self.conn.execute(sql + " ORDER BY t.ts", params)
+
+    def query(self, kind, name, metric, ts_from=None, ts_to=None, cluster=None):
+        # [(cluster, ts, value)]
+        return self._range("samples", "t.ts, t.value", kind, name, metric, ts_from, ts_to, cluster).fetchall()
+
+    def query_series(self, kind, name, metric, ts_from=None, ts_to=None, cluster=None):
+        # [(cluster, start_ts, step, array)]
+        res = []
+        for cluster_name, ts, step, blob in self._range("series", "t.ts, t.step, t.data", kind, name,
+                                                        metric, ts_from, ts_to, cluster):
+            res.append((cluster_name, ts, step, numpy.frombuffer(zlib.decompress(blob), dtype=numpy.float32)))
+        return res
+
+    def entities(self, kind=None, cluster=None):
+        sql = "SELECT cluster, kind, name FROM entities WHERE 1"
+        params = []
+        if kind is not None:
+            sql += " AND kind = ?"
+            params.append(kind)
+        if cluster is not None:
+            sql += " AND cluster = ?"
+            params.append(cluster)
+        return self.conn.execute(sql + " ORDER BY cluster, kind, name", params).fetchall()
+
+    def metric_names(self, kind):
+        return [name for name, in self.conn.execute(
+            "SELECT DISTINCT m.name FROM samples AS s " +
+            "JOIN entities AS e ON e.id = s.entity_id " +
+            "JOIN metrics AS m ON m.id = s.metric_id " +
+            "WHERE e.kind = ? ORDER BY m.name", (kind,))]
+
+
+def draw_trends(history, out_folder, kind, metrics=None, ts_from=None, ts_to=None, cluster=None):
+    report = Report("history", "index.html")
+    report.style.append('body {font: 10pt sans;}')
+    report.style.append(".usage {width: 900px; height: 200px;}")
+    report.style_links.append("https://maxcdn.bootstrapcdn.com/bootstrap/3.3.4/css/bootstrap.min.css")
+    report.script_links.extend(rickshaw_js_links)
+
+    if metrics is None:
+        metrics = history.metric_names(kind)
+
+    entities = history.entities(kind, cluster)
+    for pos, metric in enumerate(metrics):
+        series = []
+        for cluster_name, _, name in entities:
+            points = history.query(kind, name, metric, ts_from, ts_to, cluster_name)
+            if points:
+                series.append({'name': "{0}/{1}".format(cluster_name, name) if cluster is None else name,
+                               'data': [{'x': ts, 'y': val} for _, ts, val in points]})
+
+        if len(series) == 0:
+            continue
+
+        # spread series colors over the same color map, as OSD graphs use
+        for idx, line in enumerate(series):
+            line['color'] = val_to_color(float(idx) / max(1, len(series) - 1))
+
+        div_id = "trend_{0}".format(pos)
+        report.add_block(12, "{0} {1}".format(kind, metric), H.div(id=div_id, _class="usage"))
+        report.add_hidden(
+            rickshaw_code
+            .replace('__div_id__', div_id)
+            .replace('__graph_var_name__', "trend_var_{0}".format(pos))
+            .replace('__width__', '900')
+            .replace('__height__', '200')
+            .replace('__series__', ",\n".join(map(json.dumps, series))) + "\n"
+        )
+        report.next_line()
+
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+    report.save_to(out_folder)
+    return os.path.join(out_folder, "index.html")
+
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description="Historical metrics store for collected ceph data")
+    p.add_argument("db", help="History database file")
+    sub = p.add_subparsers(dest="subparser_name")
+
+    ingest = sub.add_parser("ingest", help="Add collected archives/folders to history")
+    ingest.add_argument("--cluster", default=None, help="Cluster name, fsid by default")
+    ingest.add_argument("data", nargs="+", help="Folders with data or .tar.gz archives")
+
+    query = sub.add_parser("query", help="Print metric values for entity")
+    query.add_argument("--cluster", default=None)
+    query.add_argument("--from", dest="ts_from", type=parse_time, default=None, help="unix time or YYYY-MM-DD")
+    query.add_argument("--to", dest="ts_to", type=parse_time, default=None, help="unix time or YYYY-MM-DD")
+    query.add_argument("kind", choices=('cluster', 'osd', 'dev', 'host', 'net', 'pool'))
+    query.add_argument("name", help="entity name, like osd.12, host:sdb or '' for cluster")
+    query.add_argument("metric")
+
+    trend = sub.add_parser("trend", help="Draw trend charts")
+    trend.add_argument("--cluster", default=None)
+    trend.add_argument("--from", dest="ts_from", type=parse_time, default=None, help="unix time or YYYY-MM-DD")
+    trend.add_argument("--to", dest="ts_to", type=parse_time, default=None, help="unix time or YYYY-MM-DD")
+    trend.add_argument("-m", "--metric", action="append", default=None, help="Metric to draw, all by default")
+    trend.add_argument("-o", "--out", required=True, help="Report output folder")
+    trend.add_argument("kind", choices=('cluster', 'osd', 'dev', 'host', 'net', 'pool'))
+
+    return p.parse_args(argv[1:])
+
+
+def main(argv):
+    opts = parse_args(argv)
+    history = MetricsHistory(opts.db)
+
+    if opts.subparser_name == 'ingest':
+        for path in opts.data:
+            snap_id = history.ingest(path, opts.cluster)
+            if snap_id is None:
+                print "Skip", path, "- already ingested"
+            else:
+                print "Ingested", path
+    elif opts.subparser_name == 'query':
+        for cluster, ts, value in history.query(opts.kind, opts.name, opts.metric,
+                                                opts.ts_from, opts.ts_to, opts.cluster):
+            print cluster, datetime.datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S"), value
+    elif opts.subparser_name == 'trend':
+        print "Trends stored in", draw_trends(history, opts.out, opts.kind, opts.metric,
+                                              opts.ts_from, opts.ts_to, opts.cluster)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main(sys.argv))
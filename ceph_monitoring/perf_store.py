@@ -0,0 +1,175 @@
+import sys
+import json
+import struct
+import os.path
+import argparse
+
+import numpy
+
+
+# Columnar container for performance time series (.cdat files)
+#
+#   8 bytes       magic
+#   4 bytes       header size, little-endian uint32
+#   header        json {"start", "devices", "fields", "counts", "rows"}
+#   padding       to 8 bytes boundary
+#   int64[rows]   timestamps
+#   per field     int64[devices, rows], missing samples are MISSING
+#
+# converted data is stored under columnar/ folder with same relative path,
+# as source text files, rusage snapshots are merged to one table per type
+
+MAGIC = "CMPERF01"
+DTYPE = numpy.dtype('<i8')
+MISSING = -1
+COLUMNAR_ROOT = "columnar"
+
+
+class PerfTable(object):
+    def __init__(self, start, timestamps, devices, fields, counts, data):
+        self.start = start
+        self.timestamps = timestamps
+        self.devices = devices
+        self.fields = fields
+        self.counts = counts
+        # field => int64 array[devices, rows]
+        self.data = data
+
+    def device_columns(self, dev):
+        idx = self.devices.index(dev)
+        count = self.counts[idx]
+        return dict((field, arr[idx, :count]) for field, arr in self.data.items())
+
+    def device_array(self, dev):
+        # float64 array [samples, fields] for device
+        idx = self.devices.index(dev)
+        count = self.counts[idx]
+        return numpy.column_stack([self.data[field][idx, :count] for field in self.fields]).astype(numpy.float64)
+
+    def row(self, row_idx):
+        # dev => [field values] for devices, which has this sample
+        res = {}
+        for idx, dev in enumerate(self.devices):
+            vals = [int(self.data[field][idx, row_idx]) for field in self.fields]
+            if vals and vals[0] != MISSING:
+                res[dev] = vals
+        return res
+
+
+def load(data):
+    # data - str or mmap, returned arrays are read-only views into it
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a columnar perf data")
+
+    hdr_size, = struct.unpack("<I", data[len(MAGIC):len(MAGIC) + 4])
+    hdr_end = len(MAGIC) + 4 + hdr_size
+    header = json.loads(data[len(MAGIC) + 4:hdr_end])
+
+    offset = (hdr_end + 7) // 8 * 8
+    rows = header['rows']
+    devices = [str(dev) for dev in header['devices']]
+    fields = [str(field) for field in header['fields']]
+
+    timestamps = numpy.frombuffer(data, dtype=DTYPE, count=rows, offset=offset)
+    offset += rows * DTYPE.itemsize
+
+    block = rows * len(devices)
+    res = {}
+    for field in fields:
+        arr = numpy.frombuffer(data, dtype=DTYPE, count=block, offset=offset)
+        res[field] = arr.reshape((len(devices), rows))
+        offset += block * DTYPE.itemsize
+
+    return PerfTable(header['start'], timestamps, devices, fields, header['counts'], res)
+
+
+def dump(fd, start, timestamps, fields, samples):
+    # samples - dev => list of rows, row is list of field values
+    devices = sorted(samples)
+    rows = len(timestamps)
+    counts = [len(samples[dev]) for dev in devices]
+
+    header = json.dumps({'start': start,
+                         'devices': devices,
+                         'fields': list(fields),
+                         'counts': counts,
+                         'rows': rows})
+
+    fd.write(MAGIC)
+    fd.write(struct.pack("<I", len(header)))
+    fd.write(header)
+    fd.write("\x00" * ((-(len(MAGIC) + 4 + len(header))) % 8))
+    fd.write(numpy.asarray(timestamps, dtype=DTYPE).tostring())
+
+    for pos in range(len(fields)):
+        arr = numpy.empty((len(devices), rows), dtype=DTYPE)
+        arr.fill(MISSING)
+        for idx, dev in enumerate(devices):
+            if counts[idx] != 0:
+                arr[idx, :counts[idx]] = [sample[pos] for sample in samples[dev]]
+        fd.write(arr.tostring())
+
+
+def convert_folder(root):
+    # cluster imports this module, so it can't be imported at module level
+    from storage import RawResultStorage
+    from cluster import perf_log_formats, load_performance_log_file, \
+        parse_diskstats, parse_netdev, rusage_disk_fields, netstat_fields, RUsageLog
+
+    storage = RawResultStorage(root)
+    converted = []
+
+    def store(rel_path, *params):
+        path = os.path.join(root, COLUMNAR_ROOT, rel_path + ".cdat")
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as fd:
+            dump(fd, *params)
+        converted.append(rel_path)
+
+    perf_hosts = storage.get("perf_monitoring", expected_format=None)
+    for host in (perf_hosts if perf_hosts is not None else []):
+        for name, fields, skip, field_types in perf_log_formats:
+            rel_path = "perf_monitoring/{0}/{1}".format(host, name)
+            data = storage.get(rel_path)
+            if data is None:
+                continue
+
+            per_dev = load_performance_log_file(data, fields, skip, field_types)
+            start = min(log.start_timstamp for log in per_dev.values()) if per_dev else 0
+            samples = dict((dev, log.data) for dev, log in per_dev.items())
+            rows = max(map(len, samples.values()) + [0])
+            store(rel_path, start, [int(start) + i for i in range(rows)], fields, samples)
+
+    rusage_hosts = storage.get("rusage", expected_format=None)
+    for host in (rusage_hosts if rusage_hosts is not None else []):
+        host_stats = storage.get("rusage/" + host, expected_format=None)
+        for stat_type, parser, fields in [('disk', parse_diskstats, rusage_disk_fields),
+                                          ('net', parse_netdev, netstat_fields)]:
+            snapshots = sorted((int(name.split("-")[0]), parser(host_stats.get(name)))
+                               for name in host_stats if name.endswith("-" + stat_type))
+            if len(snapshots) == 0:
+                continue
+
+            log = RUsageLog.from_snapshots(snapshots, fields)
+            store("rusage/{0}/{1}".format(host, stat_type), log.timestamps[0], log.timestamps,
+                  fields, log.per_dev)
+
+    return converted
+
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description="Convert collected performance logs to columnar format")
+    p.add_argument("data_folder", help="Folder with unpacked data")
+    return p.parse_args(argv[1:])
+
+
+def main(argv):
+    opts = parse_args(argv)
+    for rel_path in convert_folder(opts.data_folder):
+        print "Converted", rel_path
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main(sys.argv))
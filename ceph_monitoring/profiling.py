@@ -0,0 +1,137 @@
+import os
+import time
+import resource
+import cProfile
+import contextlib
+import collections
+
+
+class StageStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.wall_time = 0.0
+        # wall time without nested stages
+        self.self_time = 0.0
+        # ru_maxrss is process peak memory since start, in KiB. It says nothing
+        # about single stage, so only peak growth during stage is accounted
+        self.rss_growth = 0
+        self.profile = None
+
+
+class StageProfiler(object):
+    """
+    Wall time and process peak memory growth of report stages. Stages may be nested, nested
+    stage is named 'parent/child'. If cprofile_dir is set each stage also runs
+    under own cProfile, which accounts only calls outside of nested stages
+    """
+    def __init__(self, cprofile_dir=None):
+        self.cprofile_dir = cprofile_dir
+        self.stages = collections.OrderedDict()
+        self.stack = []
+        self.start_time = time.time()
+
+    @staticmethod
+    def process_max_rss():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        path = "/".join([parent_name for parent_name, _ in self.stack] + [name])
+        stat = self.stages.get(path)
+        if stat is None:
+            stat = self.stages[path] = StageStats()
+            if self.cprofile_dir is not None:
+                stat.profile = cProfile.Profile()
+
+        parent = None
+        if self.stack:
+            parent = self.stages["/".join(parent_name for parent_name, _ in self.stack)]
+            if parent.profile is not None:
+                parent.profile.disable()
+
+        children_time = [0.0]
+        self.stack.append((name, children_time))
+        rss0 = self.process_max_rss()
+        t0 = time.time()
+        if stat.profile is not None:
+            stat.profile.enable()
+
+        try:
+            yield
+        finally:
+            if stat.profile is not None:
+                stat.profile.disable()
+
+            dtime = time.time() - t0
+            rss = self.process_max_rss()
+            self.stack.pop()
+
+            stat.calls += 1
+            stat.wall_time += dtime
+            stat.self_time += dtime - children_time[0]
+            stat.rss_growth += rss - rss0
+
+            if parent is not None:
+                self.stack[-1][1][0] += dtime
+                if parent.profile is not None:
+                    parent.profile.enable()
+
+    def profile_path(self, path):
+        return os.path.join(self.cprofile_dir, path.replace("/", "__") + ".prof")
+
+    def dump_profiles(self):
+        res = []
+        if self.cprofile_dir is not None:
+            if not os.path.isdir(self.cprofile_dir):
+                os.makedirs(self.cprofile_dir)
+            for path, stat in self.stages.items():
+                stat.profile.dump_stats(self.profile_path(path))
+                res.append(self.profile_path(path))
+        return res
+
+    def to_json(self):
+        stages = []
+        for path, stat in self.stages.items():
+            stages.append({'name': path,
+                           'calls': stat.calls,
+                           'wall_time': stat.wall_time,
+                           'self_time': stat.self_time,
+                           'rss_growth_kb': stat.rss_growth,
+                           'cprofile': None if stat.profile is None else self.profile_path(path)})
+
+        return {'stages': stages,
+                'wall_time': time.time() - self.start_time,
+                'process_max_rss_kb': self.process_max_rss(),
+                'children_max_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+
+    def format_report(self):
+        tmpl = "{0:<60s} {1:>5} {2:>9} {3:>9} {4:>18}"
+        lines = [tmpl.format("Stage", "Calls", "Wall, s", "Self, s", "Peak RSS grow, KiB")]
+        for path, stat in self.stages.items():
+            lines.append(tmpl.format(path, stat.calls,
+                                     "{0:.3f}".format(stat.wall_time),
+                                     "{0:.3f}".format(stat.self_time),
+                                     stat.rss_growth))
+        lines.append("Total: {0:.3f}s, process peak RSS {1} KiB".format(time.time() - self.start_time,
+                                                                      self.process_max_rss()))
+        return "\n".join(lines)
+
+
+# process wide, stages are spread over storage, model and report code
+_profiler = None
+
+
+def enable_profiling(cprofile_dir=None):
+    global _profiler
+    if _profiler is None:
+        _profiler = StageProfiler(cprofile_dir)
+    return _profiler
+
+
+@contextlib.contextmanager
+def stage(name):
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.stage(name):
+            yield
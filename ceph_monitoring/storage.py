@@ -1,49 +1,394 @@
+import os
+import abc
+import time
+import zlib
 import json
+import hashlib
+import mmap
+import stat
+import bisect
 import os.path
+import tarfile
+import posixpath
+import contextlib
+import collections
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
-class RawResultStorage(object):
-    def __init__(self, root):
-        self._root = root
-        self._all = None
 
-    def _load(self):
-        if self._all is None:
-            self._all = {}
-            rt = os.path.abspath(self._root)
-            for fname in os.listdir(rt):
-                if fname.startswith('.'):
+def resolve_ref(ref_path, ref_data):
+    # collect_info stores duplicated outputs as reference to the first copy
+    # NAME.ref files contains json {"ext": real_ext, "target": rel_path}
+    ref = json.loads(ref_data)
+    full_path = posixpath.normpath(posixpath.join(posixpath.dirname(ref_path), ref['target']))
+    return ref['ext'], full_path
+
+
+def iter_lines(data):
+    # lines of str or mmap, mmap is never copied as a whole
+    if isinstance(data, basestring):
+        for line in data.split("\n"):
+            yield line
+        return
+
+    pos = 0
+    while True:
+        end = data.find("\n", pos)
+        if end == -1:
+            yield data[pos:]
+            return
+        yield data[pos:end]
+        pos = end + 1
+
+
+def data_key(path):
+    # cheap identity of collected data, which doesn't read it:
+    # archive size and mtime, for unpacked folders - files list with sizes and mtimes
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return "{0}-{1!r}".format(st.st_size, st.st_mtime)
+    return content_hash(path)
+
+
+def content_hash(path, chunk_size=1024 ** 2):
+    # sha1 of archive content, for unpacked folders - of files list with sizes and mtimes
+    hasher = hashlib.sha1()
+    if os.path.isfile(path):
+        with open(path, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(chunk_size), ""):
+                hasher.update(chunk)
+    else:
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full_path = os.path.join(root, name)
+                st = os.stat(full_path)
+                hasher.update("{0} {1} {2}\n".format(os.path.relpath(full_path, path),
+                                                     st.st_size, int(st.st_mtime)))
+    return hasher.hexdigest()
+
+
+class JsonStream(object):
+    """
+    Incremental reader of json text from str or mmap. Keeps only a
+    window of text in memory, values are parsed with raw_decode
+    """
+    chunk_size = 1024 ** 2
+    decoder = json.JSONDecoder()
+    whitespace = " \t\n\r"
+    delimiters = whitespace + ",:]}"
+
+    def __init__(self, data):
+        self.data = data
+        self.data_pos = 0
+        self.buff = ""
+        self.pos = 0
+
+    def _more(self, size=None):
+        if self.data_pos >= len(self.data):
+            return False
+        chunk = self.data[self.data_pos:self.data_pos + (size or self.chunk_size)]
+        self.data_pos += len(chunk)
+        self.buff = self.buff[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buff) and self.buff[self.pos] in self.whitespace:
+                self.pos += 1
+            if self.pos < len(self.buff) or not self._more():
+                break
+
+        if self.pos >= len(self.buff):
+            raise ValueError("Unexpected end of json data")
+        return self.buff[self.pos]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expect {0!r} at {1}, got {2!r}".format(
+                char, self.data_pos - len(self.buff) + self.pos, self.buff[self.pos]))
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        # grow window exponentially, so large values are not reparsed too often
+        size = self.chunk_size
+        while True:
+            try:
+                res, end = self.decoder.raw_decode(self.buff, self.pos)
+                # number may be cut by window end, like "1.5" from "1.5e-7"
+                if self.data_pos >= len(self.data) or \
+                        (end < len(self.buff) and self.buff[end] in self.delimiters):
+                    self.pos = end
+                    return res
+            except ValueError:
+                if self.data_pos >= len(self.data):
+                    raise
+            self._more(size)
+            size *= 2
+
+    def iter_object(self):
+        # yield keys of object, caller must consume value after each key
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect('}')
+                return
+
+    def iter_array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+
+def iter_json_array(data, path, fields=None):
+    """
+    Yield items of array data[path[0]][path[1]]... one by one, without
+    building whole document. If fields is set - items are projected
+    into dicts with only this keys
+    """
+    stream = JsonStream(data)
+    for key in path:
+        for name in stream.iter_object():
+            if name == key:
+                break
+            stream.value()
+        else:
+            raise KeyError("No {0!r} in json".format(key))
+
+    for item in stream.iter_array():
+        if fields is not None:
+            item = dict((name, item[name]) for name in fields if name in item)
+        yield item
+
+
+class StorageIndex(object):
+    """
+    In-memory tree of stored results, built once and shared by all
+    sub-storages. dirs maps folder path to {name: (is_file, ext, path, size)},
+    all paths are relative to storage root and '/'-separated
+    """
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self):
+        self.dirs = {"": {}}
+        self.stats = None
+
+    def add_dir(self, path):
+        if path not in self.dirs:
+            self.dirs[path] = {}
+            parent, name = posixpath.split(path)
+            self.add_dir(parent)
+            self.dirs[parent][name] = (False, None, path, 0)
+
+    def add_file(self, path, size):
+        parent, fname = posixpath.split(path)
+        if fname.startswith('.') or '.' not in fname:
+            return False
+
+        self.add_dir(parent)
+        fname_no_ext, ext = fname.rsplit('.', 1)
+        self.dirs[parent][fname_no_ext] = (True, ext, path, size)
+        return True
+
+    def file_size(self, path):
+        parent, fname = posixpath.split(path)
+        return self.dirs[parent][fname.rsplit('.', 1)[0]][3]
+
+    @abc.abstractmethod
+    def read(self, path):
+        pass
+
+    def read_buffer(self, path):
+        return self.read(path)
+
+    def reopen(self):
+        # called in forked process, which must not share file positions with parent
+        pass
+
+
+class DirIndex(StorageIndex):
+    def __init__(self, root, mmap_threshold=None):
+        StorageIndex.__init__(self)
+        self.root = os.path.abspath(root)
+        self.mmap_threshold = mmap_threshold
+        self.mapped = {}
+
+        stack = [""]
+        while stack:
+            path = stack.pop()
+            for name, is_dir, size in self.list_dir(os.path.join(self.root, path)):
+                if name.startswith('.'):
                     continue
 
-                full_path = os.path.join(rt, fname)
+                rel_path = path + "/" + name if path else name
+                if is_dir:
+                    self.add_dir(rel_path)
+                    stack.append(rel_path)
+                else:
+                    self.add_file(rel_path, size)
 
-                if '.' in fname:
-                    fname_no_ext, ext = fname.rsplit('.', 1)
-                    self._all[fname_no_ext] = (True, ext, full_path)
+    @staticmethod
+    def list_dir(path):
+        if scandir is not None:
+            for entry in scandir(path):
+                if entry.is_dir():
+                    yield entry.name, True, 0
                 else:
-                    self._all[fname] = (False, None, full_path)
+                    yield entry.name, False, entry.stat().st_size
+        else:
+            for name in os.listdir(path):
+                st = os.stat(os.path.join(path, name))
+                yield name, stat.S_ISDIR(st.st_mode), st.st_size
 
-        return self._all
+    def read(self, path):
+        with open(os.path.join(self.root, path), 'rb') as fd:
+            return fd.read()
+
+    def read_buffer(self, path):
+        # read-only mapping of large files - data stays in page cache
+        # and is shared with other processes reading the same results
+        if path in self.mapped:
+            return self.mapped[path]
+
+        size = self.file_size(path)
+        if self.mmap_threshold is None or size == 0 or size < self.mmap_threshold:
+            return self.read(path)
+
+        with open(os.path.join(self.root, path), 'rb') as fd:
+            self.mapped[path] = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mapped[path]
+
+
+class TarArchive(StorageIndex):
+    """
+    Index of collected archive. Index is built on first access, as it requires
+    to decompress whole archive, data is decompressed only when member is accessed
+    """
+    def __init__(self, path):
+        self.path = path
+        self.stats = None
 
     def __getattr__(self, name):
-        self._load()
+        if name in ('dirs', 'tar', 'members'):
+            self.build()
+            return self.__dict__[name]
+        raise AttributeError(name)
 
-        path = os.path.join(self._root, name)
-        if os.path.isdir(path):
-            return True, None, self.__class__(path)
+    def build(self):
+        self.dirs = {"": {}}
 
-        if name in self._all:
-            is_file, ext, full_path = self._all[name]
-            setattr(self, name, (is_file, ext, full_path))
+        with open(self.path, 'rb') as fd:
+            magic = fd.read(2)
 
-            if is_file:
-                data = open(full_path, 'rb').read()
-                return ext != 'err', ext, data
-            else:
-                return True, None, self.__class__(full_path)
+        if magic == '\x1f\x8b':
+            self.tar = tarfile.open(fileobj=GzipIndexedFile(self.path), mode='r:')
+        else:
+            # plain tar is seekable as is, other compressions are read as stream
+            self.tar = tarfile.open(self.path)
+
+        self.members = {}
+        for member in self.tar.getmembers():
+            name = posixpath.normpath(member.name).lstrip('/')
+            if name == '.':
+                continue
+
+            if member.isdir():
+                self.add_dir(name)
+            elif member.isfile() and self.add_file(name, member.size):
+                self.members[name] = member
+
+    def read(self, path):
+        return self.tar.extractfile(self.members[path]).read()
+
+    def reopen(self):
+        if isinstance(self.tar.fileobj, GzipIndexedFile):
+            self.tar.fileobj.reopen()
+        else:
+            self.tar.fileobj = tarfile.open(self.path).fileobj
+
+
+class ResultStorage(object):
+    def __init__(self, index, path=""):
+        self._index = index
+        self._path = path
+
+    def _sub(self, path):
+        res = self.__class__.__new__(self.__class__)
+        ResultStorage.__init__(res, self._index, path)
+        return res
+
+    def _load(self):
+        return self._index.dirs[self._path]
+
+    def _value(self, entry, as_buffer=False):
+        is_file, ext, path, _ = entry
+        if not is_file:
+            return True, None, self._sub(path)
+
+        stats = self._index.stats
+        if stats is not None:
+            name = path.rsplit('.', 1)[0]
+            t0 = time.time()
+
+        if ext == 'ref':
+            ext, path = resolve_ref(path, self._index.read(path))
 
-        raise AttributeError(
-            "No storage for {0!r} found. Have only '{1}' attrs".format(name, ",".join(self)))
+        data = self._index.read_buffer(path) if as_buffer else self._index.read(path)
+
+        if stats is not None:
+            stats.add_read(name, len(data), time.time() - t0)
+
+        return ext != 'err', ext, data
+
+    def _entry(self, path):
+        parent, _, name = path.strip('/').rpartition('/')
+        if parent:
+            parent = self._path + "/" + parent if self._path else parent
+        else:
+            parent = self._path
+
+        try:
+            return self._index.dirs[parent][name]
+        except KeyError:
+            raise AttributeError("No storage for {0!r} found".format(path))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        try:
+            entry = self._load()[name]
+        except KeyError:
+            raise AttributeError(
+                "No storage for {0!r} found. Have only '{1}' attrs".format(name, ",".join(self)))
+
+        return self._value(entry)
 
     def __iter__(self):
         return iter(self._load().keys())
@@ -51,14 +396,7 @@ class RawResultStorage(object):
     def __getitem__(self, path):
         if '/' not in path:
             return getattr(self, path)
-
-        item, rest = path.split('/', 1)
-        is_ok, ext, data = getattr(self, item)
-        if not is_ok:
-            raise KeyError("error in path")
-        if ext is not None:
-            raise KeyError("Path not found")
-        return data[rest]
+        return self._value(self._entry(path))
 
     def get(self, path, default=None, expected_format='txt'):
         try:
@@ -71,50 +409,379 @@ class RawResultStorage(object):
 
         return data
 
+    def get_buffer(self, path, default=None, expected_format='txt'):
+        # same as get, but large files may be returned as read-only mmap
+        # objects, use iter_lines/find/slicing to avoid copying them
+        try:
+            ok, frmt, data = self._value(self._entry(path), as_buffer=True)
+        except AttributeError:
+            return default
+
+        if not ok or frmt != expected_format:
+            return default
+
+        return data
+
     def __len__(self):
         return len(self._load())
 
 
+class RawResultStorage(ResultStorage):
+    def __init__(self, root, mmap_threshold=None):
+        ResultStorage.__init__(self, DirIndex(root, mmap_threshold))
+
+
+class TarResultStorage(ResultStorage):
+    def __init__(self, arch_path):
+        ResultStorage.__init__(self, TarArchive(arch_path))
+
+
+def open_storage(path, mmap_threshold=None):
+    if os.path.isfile(path):
+        return TarResultStorage(path)
+    elif os.path.isdir(path):
+        return RawResultStorage(path, mmap_threshold)
+    raise IOError("{0!r} is neither data folder nor archive".format(path))
+
+
+class PathStats(object):
+    def __init__(self):
+        self.accesses = 0
+        self.cache_hits = 0
+        self.bytes = 0
+        self.read_time = 0.0
+        self.parse_time = 0.0
+
+    @property
+    def total_time(self):
+        return self.read_time + self.parse_time
+
+
+class StorageStats(object):
+    """
+    Per path counters of storage accesses. Paths are storage paths without
+    extension, reference files are accounted by own name, not by target
+    """
+    def __init__(self):
+        self.paths = collections.defaultdict(PathStats)
+
+    def add_read(self, path, size, read_time):
+        pstat = self.paths[path]
+        pstat.accesses += 1
+        pstat.bytes += size
+        pstat.read_time += read_time
+
+    def add_hit(self, path):
+        pstat = self.paths[path]
+        pstat.accesses += 1
+        pstat.cache_hits += 1
+
+    @contextlib.contextmanager
+    def parse(self, path):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.paths[path].parse_time += time.time() - t0
+
+    def top(self, count):
+        return sorted(self.paths.items(), key=lambda x: -x[1].total_time)[:count]
+
+    def to_json(self, cache=None):
+        res = {'paths': dict((path, {'accesses': stat.accesses,
+                                     'cache_hits': stat.cache_hits,
+                                     'bytes': stat.bytes,
+                                     'read_time': stat.read_time,
+                                     'parse_time': stat.parse_time})
+                             for path, stat in self.paths.items())}
+        if cache is not None:
+            res['json_cache'] = {'hits': cache.hits,
+                                 'misses': cache.misses,
+                                 'evictions': cache.evictions,
+                                 'size': cache.size,
+                                 'max_size': cache.max_size}
+        return res
+
+    def format_report(self, count, cache=None):
+        tmpl = "{0:<50s} {1:>8} {2:>6} {3:>12} {4:>9} {5:>9}"
+        lines = [tmpl.format("Path", "Accesses", "Hits", "Bytes", "Read, s", "Parse, s")]
+        for path, pstat in self.top(count):
+            lines.append(tmpl.format(path, pstat.accesses, pstat.cache_hits, pstat.bytes,
+                                     "{0:.3f}".format(pstat.read_time),
+                                     "{0:.3f}".format(pstat.parse_time)))
+
+        total = sum(pstat.bytes for pstat in self.paths.values())
+        lines.append("Total: {0} paths, {1} bytes read".format(len(self.paths), total))
+
+        if cache is not None:
+            requests = cache.hits + cache.misses
+            ratio = float(cache.hits) / requests if requests else 0.0
+            lines.append("Json cache: {0} hits, {1} misses, {2} evictions, hit ratio {3:.1%}".format(
+                cache.hits, cache.misses, cache.evictions, ratio))
+
+        return "\n".join(lines)
+
+
+def enable_stats(storage):
+    # all views of the same storage share the index, and so the stats
+    if storage._index.stats is None:
+        storage._index.stats = StorageStats()
+    return storage._index.stats
+
+
+@contextlib.contextmanager
+def parse_timer(storage, path):
+    # accounts parsing of text data, which is done outside of storage
+    stats = storage._index.stats
+    if stats is None:
+        yield
+    else:
+        key = storage._path + "/" + path if storage._path else path
+        with stats.parse(key):
+            yield
+
+
+class JsonCache(object):
+    """
+    LRU cache of parsed json files, shared by all JResultStorage views.
+    Size is accounted as length of json text, files larger than whole
+    budget are parsed every time and never stored
+    """
+    def __init__(self, max_size=64 * 1024 ** 2):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.items = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            obj, size = self.items.pop(key)
+        except KeyError:
+            return default
+
+        self.items[key] = (obj, size)
+        self.hits += 1
+        return obj
+
+    def load(self, key, data):
+        self.misses += 1
+        obj = json.loads(data)
+        size = len(data)
+
+        if size <= self.max_size:
+            while self.size + size > self.max_size:
+                _, (_, old_size) = self.items.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+
+            self.items[key] = (obj, size)
+            self.size += size
+
+        return obj
+
+
+_missing = object()
+
+
 class JResultStorage(object):
-    def __init__(self, storage):
+    def __init__(self, storage, cache=None):
         self.__storage = storage
-        self.__dct = []
+        self.__cache = JsonCache() if cache is None else cache
+
+    def __key(self, path):
+        path = path.strip('/')
+        return self.__storage._path + "/" + path if self.__storage._path else path
+
+    def __cached(self, key):
+        res = self.__cache.get(key, _missing)
+        if res is not _missing and self.__storage._index.stats is not None:
+            self.__storage._index.stats.add_hit(key)
+        return res
+
+    def __load(self, key, data):
+        stats = self.__storage._index.stats
+        if stats is None:
+            return self.__cache.load(key, data)
+
+        with stats.parse(key):
+            return self.__cache.load(key, data)
+
+    def __timed(self, key, items):
+        stats = self.__storage._index.stats
+        items = iter(items)
+        while True:
+            with stats.parse(key):
+                item = next(items)
+            yield item
 
     def __getattr__(self, name):
+        key = self.__key(name)
+        res = self.__cached(key)
+        if res is not _missing:
+            return res
+
         is_ok, ext, data = getattr(self.__storage, name)
 
         if not is_ok:
             raise AttributeError("{0!r} contains error".format(name))
         elif ext is None:
-            return self.__class__(data)
+            return self.__class__(data, self.__cache)
         elif ext != 'json':
             raise AttributeError("{0!r} have type {1!r}, not json".format(name, ext))
 
-        res = json.loads(data)
-        setattr(self, name, res)
-        return res
+        return self.__load(key, data)
 
     def get(self, path, default=None, expected_format='json'):
+        if expected_format == 'json':
+            res = self.__cached(self.__key(path))
+            if res is not _missing:
+                return res
+
         res = self.__storage.get(path, default, expected_format=expected_format)
         if res is not None:
-            return json.loads(res)
+            return self.__load(self.__key(path), res)
         return res
 
+    def iter_records(self, path, key, fields=None):
+        """
+        Iterate over items of json array at path[key] without loading
+        the whole file. key may be a tuple of nested keys
+        """
+        if isinstance(key, basestring):
+            key = (key,)
+
+        res = self.__cached(self.__key(path))
+        if res is _missing:
+            data = self.__storage.get_buffer(path, expected_format='json')
+            if data is None:
+                raise AttributeError("No json data at {0!r}".format(path))
+
+            if self.__storage._index.stats is not None:
+                return self.__timed(self.__key(path), iter_json_array(data, key, fields))
+            return iter_json_array(data, key, fields)
+
+        for name in key:
+            res = res[name]
+
+        if fields is None:
+            return iter(res)
+
+        return (dict((name, item[name]) for name in fields if name in item) for item in res)
+
     def __iter__(self):
         return iter(self.__storage)
 
     def __getitem__(self, path):
-        if path not in self.__dct:
-            is_ok, ext, data = self.__storage[path]
+        key = self.__key(path)
+        res = self.__cached(key)
+        if res is not _missing:
+            return res
+
+        is_ok, ext, data = self.__storage[path]
 
-            if not is_ok:
-                raise KeyError("{0!r} contains error".format(path))
+        if not is_ok:
+            raise KeyError("{0!r} contains error".format(path))
 
-            elif ext != 'json':
-                raise KeyError("{0!r} have type {1!r}, not json".format(path, ext))
+        elif ext != 'json':
+            raise KeyError("{0!r} have type {1!r}, not json".format(path, ext))
 
-            self.__dct[path] = json.loads(data)
-        return self.__dct[path]
+        return self.__load(key, data)
 
     def __len__(self):
         return len(self.__storage)
+
+
+class GzipIndexedFile(object):
+    """
+    Read-only seekable .gz file. Decompressor state is saved every
+    CHECKPOINT_SPAN bytes of output, so any seek costs at most one span
+    of decompression instead of rereading the file from the beginning
+    """
+    CHECKPOINT_SPAN = 4 * 1024 ** 2
+    READ_CHUNK = 64 * 1024
+
+    def __init__(self, path):
+        self.name = path
+        self.fd = open(path, 'rb')
+        # uncompressed offset => (compressed offset, decompressor state)
+        self.checkpoints_pos = [0]
+        self.checkpoints = [(0, zlib.decompressobj(16 + zlib.MAX_WBITS))]
+        self.pos = 0
+        self._restore(0)
+
+    def _restore(self, idx):
+        in_pos, dobj = self.checkpoints[idx]
+        self.fd.seek(in_pos)
+        self.dobj = dobj.copy()
+        self.dec_pos = self.checkpoints_pos[idx]
+        self.buff = ""
+        self.eof = False
+
+    def _feed(self):
+        data = self.fd.read(self.READ_CHUNK)
+        if not data:
+            self.eof = True
+            return ""
+
+        out = self.dobj.decompress(data)
+
+        # concatenated gzip members
+        while self.dobj.unused_data:
+            rest = self.dobj.unused_data
+            self.dobj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            out += self.dobj.decompress(rest)
+
+        self.dec_pos += len(out)
+        if self.dec_pos >= self.checkpoints_pos[-1] + self.CHECKPOINT_SPAN:
+            self.checkpoints_pos.append(self.dec_pos)
+            self.checkpoints.append((self.fd.tell(), self.dobj.copy()))
+        return out
+
+    def _seek_to(self, pos):
+        # self.buff always ends at self.dec_pos
+        idx = bisect.bisect_right(self.checkpoints_pos, pos) - 1
+        if pos < self.dec_pos - len(self.buff) or self.checkpoints_pos[idx] > self.dec_pos:
+            self._restore(idx)
+
+        while pos > self.dec_pos and not self.eof:
+            self.buff = self._feed()
+
+        self.buff = self.buff[len(self.buff) - (self.dec_pos - pos):] if pos <= self.dec_pos else ""
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            raise IOError("Seek from the end is not supported for gzip files")
+        self.pos = offset
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        self._seek_to(self.pos)
+        parts = [self.buff]
+        have = len(self.buff)
+        while (size < 0 or have < size) and not self.eof:
+            out = self._feed()
+            parts.append(out)
+            have += len(out)
+
+        data = "".join(parts)
+        if size >= 0 and len(data) > size:
+            data, self.buff = data[:size], data[size:]
+        else:
+            self.buff = ""
+
+        self.pos += len(data)
+        return data
+
+    def reopen(self):
+        # checkpoints stay valid, only own file descriptor is needed
+        self.fd = open(self.name, 'rb')
+        self._restore(0)
+
+    def close(self):
+        self.fd.close()
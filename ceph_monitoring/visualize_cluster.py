@@ -2,20 +2,22 @@ import sys
 import json
 import shutil
 import pprint
+import cPickle
 import bisect
 import os.path
-import warnings
 import argparse
 import itertools
-import subprocess
 import collections
 
+import numpy
+
 import html2
 
-from hw_info import b2ssize
+from hw_info import b2ssize, ssize2b
 import ceph_report_template
-from cluster import CephCluster
-from storage import RawResultStorage, JResultStorage
+from cluster import CephCluster, CLUSTER_MODEL_VERSION
+from storage import open_storage, JResultStorage, JsonCache, data_key, enable_stats
+from profiling import enable_profiling, stage
 
 
 H = html2.rtag
@@ -173,7 +175,7 @@ def show_summary(report, cluster):
     avail_perc = cluster.bytes_avail * 100 / cluster.bytes_total
     t.add_cells("Free %", avail_perc)
 
-    osd_count = len(cluster.osds)
+    osd_count = len(cluster.osd_ids)
     t.add_cells("Mon count", len(cluster.mons))
 
     report.add_block(3, "Status:", t)
@@ -298,13 +300,11 @@ def show_pools_info(report, cluster):
         table.add_cell(str(pool.pg_num))
         table.add_cell(str(pool.pg_placement_num))
 
-        if cluster.sum_per_osd is None:
+        stats = cluster.pg_distribution.pool_stats(pool.name)
+        if stats is None:
             table.add_cell('-')
         else:
-            row = [osd_pg.get(pool.name, 0)
-                   for osd_pg in cluster.osd_pool_pg_2d.values()]
-            avg = float(sum(row)) / len(row)
-            dev = (sum((i - avg) ** 2.0 for i in row) / len(row)) ** 0.5
+            avg, dev, _, _ = stats
             table.add_cell(str(int(dev * 100. / avg)))
 
         table.next_row()
@@ -715,10 +715,9 @@ def show_hosts_info(report, cluster):
                   "Load avg<br>5m"]
     table = html2.HTMLTable(headers=header_row)
     for host in sorted(cluster.hosts.values(), key=lambda x: x.name):
-        services = ["osd-{0}".format(osd.id) for osd in cluster.osds if osd.host == host.name]
-        all_mons = [mon.name for mon in cluster.mons]
+        services = ["osd-{0}".format(osd.id) for osd in cluster.osds_by_host.get(host.name, [])]
 
-        if host.name in all_mons:
+        if host.name in cluster.mon_by_name:
             services.append("mon(" + host.name + ")")
 
         table.add_cell(host.name)
@@ -750,6 +749,46 @@ def show_hosts_info(report, cluster):
     report.add_block(6, "Host's info:", table)
 
 
+def seconds_to_str(seconds):
+    seconds = int(seconds)
+    for name, scale in (('d', 24 * 3600), ('h', 3600), ('m', 60)):
+        if seconds >= scale:
+            res = "{0}{1}".format(seconds // scale, name)
+            if seconds % scale != 0:
+                res += " " + seconds_to_str(seconds % scale)
+            return res
+    return "{0}s".format(seconds)
+
+
+def show_hw_cache_info(report, cluster):
+    hosts = [host for host in cluster.hosts.values() if host.hw_cache_info]
+    if len(hosts) == 0:
+        return
+
+    table = html2.HTMLTable(headers=["Host",
+                                     "Collected<br>now",
+                                     "Taken from<br>cache",
+                                     "Oldest cached<br>item age"])
+
+    for host in sorted(hosts, key=lambda x: x.name):
+        fresh = sorted(item for item, info in host.hw_cache_info.items()
+                       if not info['cached'])
+        cached = sorted(item for item, info in host.hw_cache_info.items()
+                        if info['cached'])
+        max_age = max(info['age'] for info in host.hw_cache_info.values())
+
+        table.add_cell(host.name)
+        table.add_cell("<br>".join(fresh) if fresh else '-')
+        table.add_cell("<br>".join(cached) if cached else '-')
+        if cached:
+            table.add_cell(seconds_to_str(max_age), sorttable_customkey=str(max_age))
+        else:
+            table.add_cell('-', sorttable_customkey='0')
+        table.next_row()
+
+    report.add_block(6, "HW info freshness:", table)
+
+
 def show_hosts_resource_usage(report, cluster):
     nets_info = {}
 
@@ -852,13 +891,9 @@ def get_io_resource_usage(cluster):
             if dev not in perf_m['io']:
                 continue
 
-            prev_val = perf_m['io'][dev].values[0]
-            writes = []
-            reads = []
-            for val in perf_m['io'][dev].values[1:]:
-                writes.append(val.writes_completed - prev_val.writes_completed)
-                reads.append(val.reads_completed - prev_val.reads_completed)
-                prev_val = val
+            log = perf_m['io'][dev]
+            writes = numpy.diff(log['writes_completed']).tolist()
+            reads = numpy.diff(log['reads_completed']).tolist()
 
             dev_uuid = "osd-{0}.{1}".format(str(osd.id), tp)
             writes_per_dev[dev_uuid] = writes
@@ -985,21 +1020,17 @@ def show_osd_pool_PG_distribution(report, cluster):
         report.add_block(6, "PG copy per OSD: No pg dump data. Probably too many PG", "")
         return
 
-    pools = sorted(cluster.sum_per_pool)
-    table = html2.HTMLTable(headers=["OSD/pool"] + list(pools) + ['sum'])
-
-    for osd_id, row in sorted(cluster.osd_pool_pg_2d.items()):
-        data = [osd_id] + \
-               [row.get(pool_name, 0) for pool_name in pools] + \
-               [cluster.sum_per_osd[osd_id]]
+    pg_dist = cluster.pg_distribution
+    table = html2.HTMLTable(headers=["OSD/pool"] + pg_dist.pool_names + ['sum'])
 
-        table.add_row(map(str, data))
+    for osd_id, row, osd_sum in zip(pg_dist.osd_ids, pg_dist.matrix.tolist(), pg_dist.per_osd.tolist()):
+        table.add_row(map(str, [osd_id] + row + [osd_sum]))
 
     table.add_cell("sum",
                    sorttable_customkey=str(max(osd.id for osd in cluster.osds) + 1))
 
-    map(table.add_cell, (cluster.sum_per_pool[pool_name] for pool_name in pools))
-    table.add_cell(str(sum(cluster.sum_per_pool.values())))
+    map(table.add_cell, pg_dist.per_pool.tolist())
+    table.add_cell(str(int(pg_dist.per_pool.sum())))
 
     report.add_block(8, "PG copy per OSD:", table)
 
@@ -1146,119 +1177,198 @@ def parse_args(argv):
                    action="store_true")
     p.add_argument("-g", "--no-graph", help="Don't draw OSD graphs", default=False,
                    action="store_true")
-    p.add_argument("--profile", help="Don't draw OSD graphs", default=False,
-                   action="store_true")
+    p.add_argument("--summary-only", default=False, action="store_true",
+                   help="Show only cluster summary, most of per-OSD and per-host data is not loaded")
+    p.add_argument("--profile", default=False, action="store_true",
+                   help="Print wall time and peak memory of report stages and store " +
+                        "them to stage_profile.json in report folder")
+    p.add_argument("--cprofile-dir", default=None, metavar="DIR",
+                   help="Run each report stage under cProfile and store STAGE.prof files to DIR, " +
+                        "implies --profile")
+    p.add_argument("--mmap-threshold", type=ssize2b, default=None, metavar="SIZE",
+                   help="Memory-map data files larger than SIZE (e.g. 1m) instead of reading them")
+    p.add_argument("--json-cache", type=ssize2b, default="64m", metavar="SIZE",
+                   help="Keep at most SIZE of parsed json files in memory (default 64m)")
+    p.add_argument("-j", "--load-workers", type=int, default=None, metavar="COUNT",
+                   help="Processes to load hosts data in (default - cpu count), " +
+                        "used only for large clusters")
+    p.add_argument("--no-model-cache", action="store_true", default=False,
+                   help="Don't use/store loaded cluster model cache next to data")
+    p.add_argument("--storage-stats", type=int, default=None, metavar="COUNT", nargs="?", const=20,
+                   help="Print COUNT (default 20) most expensive storage paths and store " +
+                        "all stats to storage_stats.json in report folder. " +
+                        "Use with --no-model-cache to account model loading")
     p.add_argument("data_folder", help="Folder with data, or .tar.gz archive")
     return p.parse_args(argv[1:])
 
 
-def main(argv):
-    opts = parse_args(argv)
-    remove_folder = False
-
-    if os.path.isfile(opts.data_folder):
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            arch_name = opts.data_folder
-            folder = os.tempnam()
-            os.makedirs(folder)
-            remove_folder = True
-            subprocess.call("tar -zxvf {0} -C {1} >/dev/null 2>&1".format(arch_name, folder), shell=True)
+def load_cluster(opts, storage, jstorage):
+    if opts.no_model_cache:
+        cluster = CephCluster(jstorage, storage)
+        if not opts.summary_only:
+            cluster.load(opts.load_workers)
+        return cluster
+
+    # cache file starts with pickled key, so stale cache is detected without loading model.
+    # Key doesn't require to read data and archive index is built only on cache miss
+    cache_path = opts.data_folder.rstrip('/') + ".model_cache"
+    key = "{0}-{1}".format(CLUSTER_MODEL_VERSION, data_key(opts.data_folder))
+
+    if os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'rb') as fd:
+                if cPickle.load(fd) == key:
+                    cluster = cPickle.load(fd)
+                    cluster.storage = storage
+                    cluster.jstorage = jstorage
+                    return cluster
+        except Exception as exc:
+            print "Failed to load cluster model cache from", cache_path, ":", exc
+
+    cluster = CephCluster(jstorage, storage)
+
+    # sections are loaded on demand, partially loaded model isn't cached
+    if opts.summary_only:
+        return cluster
+
+    cluster.load(opts.load_workers)
+
+    try:
+        with open(cache_path + ".tmp", 'wb') as fd:
+            cPickle.dump(key, fd, cPickle.HIGHEST_PROTOCOL)
+            cPickle.dump(cluster, fd, cPickle.HIGHEST_PROTOCOL)
+        os.rename(cache_path + ".tmp", cache_path)
+    except Exception as exc:
+        # cache is optional, any failure (including unpicklable model) only disables it
+        print "Can't store cluster model cache to", cache_path, ":", exc
+        if os.path.exists(cache_path + ".tmp"):
+            os.unlink(cache_path + ".tmp")
+
+    return cluster
+
+
+def make_report(opts, storage):
+    stats = None if opts.storage_stats is None else enable_stats(storage)
+    cache = JsonCache(opts.json_cache)
+    jstorage = JResultStorage(storage, cache)
+
+    with stage("load_cluster"):
+        cluster = load_cluster(opts, storage, jstorage)
+
+    report = Report(opts.name, "index.html")
+    report.style.append('body {font: 10pt sans;}')
+    report.style_links.append("https://maxcdn.bootstrapcdn.com/bootstrap/3.3.4/css/bootstrap.min.css")
+
+    if opts.simple:
+        dct = html2.HTMLTable.def_table_attrs
+        dct['class'] = dct['class'].replace("sortable", "").replace("zebra-table", "")
     else:
-        folder = opts.data_folder
+        report.script_links.append("http://www.kryogenix.org/code/browser/sorttable/sorttable.js")
 
-    if not os.path.isdir(folder):
-        print "First argument should be a folder with data or path to archive"
-        return 1
+    def show(func):
+        with stage(func.__name__):
+            func(report, cluster)
 
-    index_path = os.path.join(opts.out, 'index.html')
-    if os.path.exists(index_path):
-        if not opts.overwrite:
-            print index_path, "already exists. Exits"
-            return 1
-    elif not os.path.exists(opts.out):
-        os.makedirs(opts.out)
+    show(show_summary)
+    report.next_line()
 
-    try:
-        storage = RawResultStorage(folder)
-        jstorage = JResultStorage(storage)
+    if opts.summary_only:
+        with stage("save_to"):
+            report.save_to(opts.out)
+        if stats is not None:
+            store_storage_stats(opts, stats, cache)
+        return cluster
 
-        cluster = CephCluster(jstorage, storage)
-        cluster.load()
+    show(show_hosts_info)
+    show(show_mons_info)
+    show(show_osd_state)
+    report.next_line()
 
-        report = Report(opts.name, "index.html")
-        report.style.append('body {font: 10pt sans;}')
-        report.style_links.append("https://maxcdn.bootstrapcdn.com/bootstrap/3.3.4/css/bootstrap.min.css")
+    show(show_osd_info)
+    report.next_line()
 
-        if opts.simple:
-            dct = html2.HTMLTable.def_table_attrs
-            dct['class'] = dct['class'].replace("sortable", "").replace("zebra-table", "")
-        else:
-            report.script_links.append("http://www.kryogenix.org/code/browser/sorttable/sorttable.js")
+    show(show_osd_perf_info)
+    report.next_line()
 
-        show_summary(report, cluster)
-        report.next_line()
+    show(show_pools_info)
+    show(show_pg_state)
+    report.next_line()
 
-        show_hosts_info(report, cluster)
-        show_mons_info(report, cluster)
-        show_osd_state(report, cluster)
-        report.next_line()
+    show(show_osd_pool_PG_distribution)
+    report.next_line()
 
-        show_osd_info(report, cluster)
-        report.next_line()
+    show(show_host_io_load_in_color)
+    report.next_line()
 
-        show_osd_perf_info(report, cluster)
-        report.next_line()
+    show(show_host_network_load_in_color)
+    report.next_line()
 
-        show_pools_info(report, cluster)
-        show_pg_state(report, cluster)
-        report.next_line()
+    show(show_hosts_resource_usage)
+    report.next_line()
 
-        show_osd_pool_PG_distribution(report, cluster)
-        report.next_line()
+    show(show_hw_cache_info)
+    report.next_line()
 
-        show_host_io_load_in_color(report, cluster)
-        report.next_line()
+    if not opts.no_graph:
+        show(tree_to_visjs)
 
-        show_host_network_load_in_color(report, cluster)
-        report.next_line()
+    with stage("save_to"):
+        report.save_to(opts.out)
 
-        show_hosts_resource_usage(report, cluster)
-        report.next_line()
+    if stats is not None:
+        store_storage_stats(opts, stats, cache)
 
-        if not opts.no_graph:
-            tree_to_visjs(report, cluster)
+    return cluster
 
-        report.save_to(opts.out)
-        print "Report successfully stored in", index_path
 
-        # perf_path = os.path.join(opts.out, "performance.html")
-        # load_report = Report(opts.name, "performance.html")
-        # # draw_resource_usage(load_report, cluster)
-        # draw_resource_usage_rsw(load_report, cluster)
-        # load_report.save_to(opts.out)
-        # print "Peformance report successfully stored in", perf_path
-    finally:
-        if remove_folder:
-            shutil.rmtree(folder)
+def store_storage_stats(opts, stats, cache):
+    print stats.format_report(opts.storage_stats, cache)
+    with open(os.path.join(opts.out, "storage_stats.json"), "w") as fd:
+        json.dump(stats.to_json(cache), fd, indent=4, sort_keys=True)
 
 
-if __name__ == "__main__":
-    if '--profile' in sys.argv:
-        import hotshot
-        import hotshot.stats
-        prof = hotshot.Profile("/tmp/cl_2.prof")
-        prof.start()
+def store_profile(opts, profiler):
+    profiler.dump_profiles()
+    print profiler.format_report()
+    with open(os.path.join(opts.out, "stage_profile.json"), "w") as fd:
+        json.dump(profiler.to_json(), fd, indent=4, sort_keys=True)
+
 
-    res = main(sys.argv)
+def main(argv):
+    opts = parse_args(argv)
 
-    if '--profile' in sys.argv:
-        prof.stop()
-        prof.close()
+    profiler = None
+    if opts.profile or opts.cprofile_dir is not None:
+        profiler = enable_profiling(opts.cprofile_dir)
 
-        stats = hotshot.stats.load("/tmp/cl_2.prof")
-        stats.strip_dirs()
-        stats.sort_stats('time', 'calls')
-        stats.print_stats(40)
+    try:
+        with stage("open_storage"):
+            storage = open_storage(opts.data_folder, opts.mmap_threshold)
+    except IOError:
+        print "First argument should be a folder with data or path to archive"
+        return 1
 
-    exit(res)
+    index_path = os.path.join(opts.out, 'index.html')
+    if os.path.exists(index_path):
+        if not opts.overwrite:
+            print index_path, "already exists. Exits"
+            return 1
+    elif not os.path.exists(opts.out):
+        os.makedirs(opts.out)
+
+    make_report(opts, storage)
+    print "Report successfully stored in", index_path
+
+    if profiler is not None:
+        store_profile(opts, profiler)
+
+    # perf_path = os.path.join(opts.out, "performance.html")
+    # load_report = Report(opts.name, "performance.html")
+    # # draw_resource_usage(load_report, cluster)
+    # draw_resource_usage_rsw(load_report, cluster)
+    # load_report.save_to(opts.out)
+    # print "Peformance report successfully stored in", perf_path
+
+
+if __name__ == "__main__":
+    exit(main(sys.argv))